@@ -0,0 +1,96 @@
+import time
+from os import getenv
+
+from starfit.autils.human import time2human
+
+# Every client (IP address, and email address if given) has a bucket of
+# worker time in seconds.  It holds at most QUOTA_BURST seconds and is
+# refilled at QUOTA_RATE seconds per second.
+QUOTA_BURST = float(getenv("STARFIT_QUOTA_BURST", 3600))
+QUOTA_RATE = float(getenv("STARFIT_QUOTA_RATE", 1))
+
+# Longest a job that is over budget may be deferred (only when its results
+# are mailed), and the shortest time limit a GA job is cut down to
+QUOTA_MAX_DEFER = float(getenv("STARFIT_QUOTA_MAX_DEFER", 900))
+QUOTA_MIN_TIME = int(getenv("STARFIT_QUOTA_MIN_TIME", 10))
+
+PREFIX = "starfit:quota:"
+
+# Refill all buckets of a submission, then charge them all, or none if the
+# job is rejected.  Returns the decision, the charged cost and the level of
+# the emptiest bucket.
+TAKE = """
+local burst = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local min_cost = tonumber(ARGV[5])
+local max_wait = tonumber(ARGV[6])
+
+local tokens = {}
+local level = burst
+for i, key in ipairs(KEYS) do
+    local bucket = redis.call("HMGET", key, "tokens", "time")
+    local t = tonumber(bucket[1]) or burst
+    local dt = math.max(now - (tonumber(bucket[2]) or now), 0)
+    tokens[i] = math.min(burst, t + dt * rate)
+    level = math.min(level, tokens[i])
+end
+
+local decision
+if level >= cost then
+    decision = "admit"
+elseif level >= min_cost then
+    decision = "downgrade"
+    cost = math.floor(level)
+elseif (cost - level) / rate <= max_wait then
+    decision = "defer"
+else
+    decision = "reject"
+    cost = 0
+end
+
+for i, key in ipairs(KEYS) do
+    redis.call("HSET", key, "tokens", tostring(tokens[i] - cost), "time", tostring(now))
+    redis.call("EXPIRE", key, math.ceil((burst + max_wait * rate) / rate))
+end
+return {decision, tostring(cost), tostring(level)}
+"""
+
+
+def client_keys(config, client):
+    keys = [f"{PREFIX}ip:{client}"]
+    if config.mail:
+        keys.append(f"{PREFIX}email:{str(config.email).lower()}")
+    return keys
+
+
+def admit(connection, config, client, cost):
+    """
+    Charge the estimated `cost` (seconds of worker time) of a job to the
+    buckets of the client that submitted it.  Returns the decision, the
+    charged cost and the time in seconds until the job fits the budget:
+
+    - "admit": the job runs as submitted;
+    - "downgrade": a GA job runs with its time limit cut to the charged cost;
+    - "defer": the job is over budget and may start after the wait;
+    - "reject": the job is over budget; it can be resubmitted after the wait.
+    """
+    min_cost = cost
+    if config.algorithm == "ga":
+        min_cost = min(cost, QUOTA_MIN_TIME * len(config.batch or [config]))
+    max_wait = QUOTA_MAX_DEFER if config.mail else 0
+
+    take = connection.register_script(TAKE)
+    decision, charged, level = take(
+        keys=client_keys(config, client),
+        args=[QUOTA_BURST, QUOTA_RATE, time.time(), cost, min_cost, max_wait],
+    )
+    wait = max(cost - float(level), 0) / QUOTA_RATE
+    return decision.decode(), float(charged), wait
+
+
+def downgrade(config, time_limit):
+    """Cut the time limit of a GA job (of all stars of a batch together)"""
+    config.time_limit = int(time_limit / len(config.batch or [config]))
+    config.time_eta = "in " + time2human(time_limit)
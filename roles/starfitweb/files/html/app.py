@@ -0,0 +1,348 @@
+import cgi
+import glob
+import re
+import sys
+import time
+import traceback
+from datetime import timedelta
+from io import BytesIO
+from os import getenv, path
+from uuid import uuid4
+
+import admission
+import header
+import inflight
+import metrics
+import progress
+import resultcache
+import routing
+import uploads
+from job import finish_job, follow, jinja_env, render, result_page, run_job
+from redis import Redis
+from rq import Queue
+from rq.exceptions import NoSuchJobError
+from rq.job import Job
+from starfit.autils.human import time2human
+from utils import Config, JobInfo, starfit_version
+
+# One connection pool shared by all requests served by this process
+redis = Redis()
+
+# Time after which we stop waiting on the page and fall back to email
+tmax = 55
+
+# Addresses of the reverse proxy (Apache), whose X-Forwarded-For is trusted
+TRUSTED_PROXIES = getenv("STARFIT_TRUSTED_PROXIES", "127.0.0.1 ::1").split()
+
+
+def read_labels(filename):
+    """Read 'key = label' lines; a leading asterisk marks a pre-selection"""
+    labels = dict()
+    select = list()
+    if path.isfile(filename):
+        with open(filename, "r") as f:
+            # Read each line, and put the filename and label in the dict
+            for line in f.readlines():
+                cols = line.split("=")
+                label = cols[1].strip()
+                key = cols[0].strip()
+                if label.startswith("*"):
+                    label = label[1:]
+                    select.append(key)
+                labels[key] = label
+    return labels, select
+
+
+def home(form, environ):
+    # Find DB files
+    db_files = glob.glob("/var/www/html/data/db/*.stardb.*")
+    db_labels, db_select = read_labels("/var/www/html/data/db/labels")
+
+    # If there are files that do not have a label, generate one for them based on the filename
+    for fpath in db_files:
+        fname = path.basename(fpath)
+        if fname not in db_labels:
+            db_labels[fname] = fname.split(".stardb.")[0]
+
+    # Find Star files
+    star_files = glob.glob("/var/www/html/data/stars/*.dat")
+    star_labels, star_select = read_labels("/var/www/html/data/stars/labels")
+
+    # If there are files that do not have a label, generate one for them based on the filename
+    for fpath in star_files:
+        fname = path.basename(fpath)
+        if fname not in star_labels:
+            star_labels[fname] = fname[:-4]
+
+    # set default labels
+    if len(star_select) > 0:
+        star_select = star_select[-1]
+    else:
+        star_select = next(iter(star_labels))
+
+    template = jinja_env.get_template("home.html")
+
+    # Render using DB list
+    return template.render(
+        dblist=db_labels,
+        starfit_version=starfit_version,
+        db_listing_size=str(min(30, len(db_labels))),
+        db_select=db_select,
+        starlist=star_labels,
+        star_select=star_select,
+    )
+
+
+def submit(form, environ):
+    config = Config(form)  # Validate form fields and generate config
+    ip = client_address(environ)
+
+    if len(config.errors) == 0:
+        config.cache_key = resultcache.job_key(config)
+
+    if len(config.errors) > 0:
+        # Render the configerror page
+        return render(
+            config=config,
+            result=None,
+            img_tags=[],
+            doc="configerror",
+            jobinfo=JobInfo(),
+        )
+
+    if (config.cache_key is not None) and (
+        (cached := resultcache.get(config.cache_key)) is not None
+    ):
+        # Identical job has been run before, serve the stored result
+        imgfiles = [BytesIO(plot) for plot in cached["plots"]]
+        manifest = finish_job(
+            config,
+            cached["fragment"],
+            imgfiles,
+            cached["files"],
+            f"{config.start_time}__{str(uuid4())}",
+            connection=redis,
+        )
+        return result_page(config, manifest)
+
+    description = f"""
+        StarFit job from: {ip}
+        (email: {str(config.email) if config.mail else 'None'},
+        ETA: {config.time_eta})
+        """
+    job_id = f"{config.start_time}__{str(uuid4())}"
+
+    if (config.cache_key is not None) and (
+        (leader := inflight.claim(redis, config.cache_key, job_id)) is not None
+    ):
+        # Identical job is queued or running, share its result
+        j = follow(
+            redis,
+            config,
+            leader,
+            routing.choose_queue(0.0),
+            result_ttl=600,
+            failure_ttl=600,
+            description=description,
+            job_id=job_id,
+            meta=dict(submitted=time.time(), cost=0.0),
+        )
+        jobinfo = JobInfo("queued", job_id=j.id)
+        return render(
+            config=config, result=None, img_tags=[], doc="pending", jobinfo=jobinfo
+        )
+
+    try:
+        cost = routing.estimate_cost(config)
+    except:
+        traceback.print_exc(file=sys.stderr)
+        cost = float(config.time_limit)
+
+    # Charge the job to the client's quota before it is queued
+    decision, cost, wait = admission.admit(redis, config, ip, cost)
+    if decision in ("reject", "downgrade") and config.cache_key is not None:
+        # Not the job identical submissions should follow
+        inflight.release(redis, config.cache_key, job_id)
+    if decision == "reject":
+        jobinfo = JobInfo("rejected")
+        jobinfo.wait = time2human(wait)
+        return render(
+            config=config, result=None, img_tags=[], doc="quota", jobinfo=jobinfo
+        )
+    if decision == "downgrade":
+        admission.downgrade(config, cost)
+        config.cache_key = resultcache.job_key(config)
+    config.admission = decision
+
+    # The search is canceled if nobody comes back for its results
+    progress.renew(redis, job_id)
+
+    # The job carries the hash of its star file; the file itself is stored
+    # once for all jobs using it
+    uploads.store(redis, config)
+
+    # Queue by estimated cost, so that quick fits do not wait behind long
+    # searches
+    q = Queue(routing.choose_queue(cost), connection=redis, default_timeout=86400)
+    options = dict(
+        result_ttl=600,
+        failure_ttl=600,
+        description=description,
+        job_id=job_id,
+        meta=dict(submitted=time.time(), cost=cost),
+    )
+    if decision == "defer":
+        options["meta"]["not_before"] = time.time() + wait
+        j = q.enqueue_in(timedelta(seconds=wait), run_job, config, **options)
+        jobinfo = JobInfo("scheduled", job_id=j.id)
+        jobinfo.wait = time2human(wait)
+    else:
+        j = q.enqueue_call(run_job, args=(config,), **options)
+        jobinfo = JobInfo("queued", job_id=j.id)
+
+    # Return straight away, the status page follows the job from here
+    return render(
+        config=config, result=None, img_tags=[], doc="pending", jobinfo=jobinfo
+    )
+
+
+def status(form, environ):
+    job_id = form.getfirst("id", "")
+
+    try:
+        if not re.fullmatch(r"[\w-]+", job_id):
+            raise NoSuchJobError(job_id)
+        j = Job.fetch(job_id, connection=redis)
+        # A split job is continued by the job that merges its parts
+        while "continued_by" in j.meta:
+            j = Job.fetch(j.meta["continued_by"], connection=redis)
+        config = j.args[0]
+    except NoSuchJobError:
+        return render(
+            config=None,
+            result=None,
+            img_tags=[],
+            doc="jobfail",
+            jobinfo=JobInfo("expired", "This job does not exist or has expired."),
+        )
+
+    # Followers have their own lease, their leader drops them when it lapses
+    progress.renew(redis, job_id)
+    jobstat = j.get_status()
+    elapsed = time.time() - j.meta.get("submitted", time.time())
+    jobinfo = JobInfo(jobstat, j.exc_info, job_id=job_id, elapsed=elapsed)
+
+    parts = list()
+    if "follows" not in j.meta:
+        parts = [k for k in Job.fetch_many(j.dependency_ids, connection=redis) if k]
+    if len(parts) > 0:
+        n_started = sum(k.get_status() in ("started", "finished") for k in parts)
+        if jobstat == "deferred" and n_started > 0:
+            jobinfo.status = "started"
+        jobinfo.parts = f"{sum(k.is_finished for k in parts):d} of {len(parts):d}"
+    if jobstat == "scheduled":
+        jobinfo.wait = time2human(max(j.meta.get("not_before", 0) - time.time(), 0))
+    if jobstat in ("started", "deferred") and "follows" not in j.meta:
+        if form.getfirst("stop") is not None:
+            # Take the best solution so far, the search reports it
+            progress.request_stop(redis, job_id)
+        jobinfo.progress = progress.summary(redis, job_id, max(len(parts), 1))
+        jobinfo.stopping = progress.stopping(redis, job_id)
+
+    if jobstat == "finished":
+        return result_page(config, j.result)
+    if jobstat in ("stopped", "canceled", "failed"):
+        return render(
+            config=config, result=None, img_tags=[], doc="jobfail", jobinfo=jobinfo
+        )
+    if elapsed < tmax:
+        return render(
+            config=config, result=None, img_tags=[], doc="pending", jobinfo=jobinfo
+        )
+    if config.mail and jobinfo.progress is not None:
+        # Long searches can be followed until the results are mailed
+        jobinfo.refresh = 10
+        return render(
+            config=config, result=None, img_tags=[], doc="pending", jobinfo=jobinfo
+        )
+    # Jobs followed by identical submissions are left running for them
+    if not config.mail and len(j.dependent_ids) == 0:
+        # Nobody will collect the results.  Running searches end at their
+        # next progress report and free their workers.
+        progress.request_cancel(redis, job_id)
+        for k in parts:
+            if k.get_status() == "queued":
+                k.cancel()
+        if jobstat != "started":
+            # A follower no longer keeps its leader running
+            j.cancel(remove_from_dependencies=True)
+    return render(
+        config=config, result=None, img_tags=[], doc="sendmail", jobinfo=jobinfo
+    )
+
+
+def unsubscribe(form, environ):
+    return jinja_env.get_template("unsubscribe.html").render()
+
+
+def metrics_page(form, environ):
+    """Prometheus metrics (not proxied by Apache, scraped locally)"""
+    headers = [("Content-Type", "text/plain; version=0.0.4; charset=utf-8")]
+    return metrics.exposition(redis), headers
+
+
+routes = {
+    "/": home,
+    "/index.html": home,
+    "/run": submit,
+    "/status": status,
+    "/unsubscribe": unsubscribe,
+    "/metrics": metrics_page,
+}
+
+
+def client_address(environ):
+    """
+    Address of the browser, also when we are behind Apache's proxy.  The
+    proxy appends the address it was connected from to X-Forwarded-For;
+    the entries before it come from the client and can be anything.
+    """
+    address = environ.get("REMOTE_ADDR", "unknown")
+    forwarded = environ.get("HTTP_X_FORWARDED_FOR")
+    if forwarded and address in TRUSTED_PROXIES:
+        return forwarded.split(",")[-1].strip()
+    return address
+
+
+def application(environ, start_response):
+    """
+    WSGI entry point.  Works both behind the proxied application server and
+    from the CGI shims (where the route is the script name).
+    """
+    route = environ.get("SCRIPT_NAME", "") + environ.get("PATH_INFO", "")
+    view = routes.get(route)
+    if view is None:
+        start_response("404 Not Found", [("Content-Type", "text/plain")])
+        return [b"Not Found"]
+
+    try:
+        form = cgi.FieldStorage(fp=environ["wsgi.input"], environ=environ)
+        page = view(form, environ)
+        headers = header.headers
+        if isinstance(page, tuple):
+            page, headers = page
+    except Exception:
+        traceback.print_exc(file=sys.stderr)
+        start_response(
+            "500 Internal Server Error",
+            [("Content-Type", "text/plain")],
+            sys.exc_info(),
+        )
+        return [b"Internal Server Error"]
+
+    body = page.encode("utf-8")
+    start_response(
+        "200 OK",
+        headers + [("Content-Length", str(len(body)))],
+    )
+    return [body]
@@ -0,0 +1,64 @@
+import shutil
+import sys
+import time
+from os import getenv
+from pathlib import Path
+
+# Files produced by a job (plots, data files, mail bodies), one directory per job
+ARTIFACT_DIR = Path(getenv("STARFIT_ARTIFACTS", "/var/lib/starfit/jobs"))
+
+# Where Apache serves ARTIFACT_DIR
+ARTIFACT_URL = getenv("STARFIT_ARTIFACT_URL", "/jobs")
+
+# Job directories older than this are removed by collect() (s)
+ARTIFACT_TTL = int(getenv("STARFIT_ARTIFACT_TTL", 2 * 86400))
+
+
+def job_dir(job_id):
+    path = ARTIFACT_DIR / job_id
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def save(job_id, name, data):
+    path = job_dir(job_id) / name
+    if isinstance(data, str):
+        path.write_text(data)
+    else:
+        path.write_bytes(data)
+    return path
+
+
+def copy(job_id, name, src):
+    path = job_dir(job_id) / name
+    shutil.copyfile(src, path)
+    return path
+
+
+def read(job_id, name):
+    return (ARTIFACT_DIR / job_id / name).read_text()
+
+
+def url(job_id, name):
+    return f"{ARTIFACT_URL}/{job_id}/{name}"
+
+
+def remove(job_id):
+    shutil.rmtree(ARTIFACT_DIR / job_id, ignore_errors=True)
+
+
+def collect(ttl=ARTIFACT_TTL):
+    """Remove the directories of jobs that finished more than `ttl` seconds ago"""
+    if not ARTIFACT_DIR.is_dir():
+        return
+    expire = time.time() - ttl
+    for path in ARTIFACT_DIR.iterdir():
+        if path.is_dir() and path.stat().st_mtime < expire:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        collect(int(sys.argv[1]))
+    else:
+        collect()
@@ -0,0 +1,84 @@
+import sys
+import traceback
+from collections import OrderedDict
+from copy import copy
+from os import getenv
+from pathlib import Path
+
+from starfit import DB
+from starfit.autils.stardb import StarDB
+
+# Byte budget for parsed databases held by one worker process
+DB_CACHE_SIZE = int(getenv("STARFIT_DB_CACHE_SIZE", 2 * 2**30))
+
+
+class DBCache(object):
+    """LRU cache of parsed model databases, keyed by path and mtime"""
+
+    def __init__(self, max_bytes=DB_CACHE_SIZE):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+
+    @staticmethod
+    def sizeof(db):
+        return db.data.nbytes + db.fielddata.nbytes
+
+    def get(self, path):
+        path = Path(path).resolve()
+        key = (path, path.stat().st_mtime_ns)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            db = self.entries[key][0]
+        else:
+            db = StarDB(path, silent=True)
+
+            # A file that changed on disk replaces its old entry
+            for k in [k for k in self.entries if k[0] == path]:
+                self._evict(k)
+
+            size = self.sizeof(db)
+            self.entries[key] = (db, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes and len(self.entries) > 1:
+                self._evict(next(iter(self.entries)))
+
+        # StarFit normalises the units of the mass fields in place, so hand
+        # out a shallow copy that shares the (read-only) data arrays
+        db = copy(db)
+        db.fieldunits = db.fieldunits.copy()
+        return db
+
+    def _evict(self, key):
+        _, size = self.entries.pop(key)
+        self.nbytes -= size
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+
+cache = DBCache()
+
+
+def load(paths):
+    return [cache.get(path) for path in paths]
+
+
+def preload(names=None):
+    """Parse the databases that are pre-selected on the web form"""
+    db_dir = Path(getenv("STARFIT_DATA")) / DB
+    if names is None:
+        names = list()
+        labels_file = db_dir / "labels"
+        if labels_file.is_file():
+            with open(labels_file, "r") as f:
+                for line in f.readlines():
+                    cols = line.split("=")
+                    if len(cols) > 1 and cols[1].strip().startswith("*"):
+                        names.append(cols[0].strip())
+    for name in names:
+        try:
+            cache.get(db_dir / name)
+        except:
+            traceback.print_exc(file=sys.stderr)
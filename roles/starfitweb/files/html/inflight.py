@@ -0,0 +1,89 @@
+import time
+from os import getenv
+
+from rq.exceptions import NoSuchJobError
+from rq.job import Job
+
+# Jobs that are queued or running, by the hash of their inputs (the result
+# cache key), so that identical submissions attach to them instead of
+# computing the same result again.  An entry outlives its job by at most
+# INFLIGHT_TTL seconds; a finished or failed job is not followed.
+INFLIGHT_TTL = int(getenv("STARFIT_INFLIGHT_TTL", 86400))
+
+# A job is queued at most this many seconds after its entry is made; an
+# entry naming a job that is not in Redis is only replaced after this time
+CLAIM_WAIT = int(getenv("STARFIT_CLAIM_WAIT", 5))
+CLAIM_POLL = 0.1
+
+PREFIX = "starfit:inflight:"
+
+LIVE = ("queued", "deferred", "scheduled", "started")
+
+# Delete the entry only if it still names the job
+RELEASE = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+# Make the entry name another job, only if it still names the ended one
+REPLACE = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("SET", KEYS[1], ARGV[2], "EX", ARGV[3])
+end
+return false
+"""
+
+
+def live_job(connection, job_id):
+    """
+    The job `job_id`, or the job continuing it, if it has not ended yet;
+    otherwise None
+    """
+    try:
+        job = Job.fetch(job_id, connection=connection)
+        # A split job has ended when the job merging its parts has
+        while "continued_by" in job.meta:
+            job = Job.fetch(job.meta["continued_by"], connection=connection)
+    except NoSuchJobError:
+        return None
+    if job.get_status() in LIVE:
+        return job
+    return None
+
+
+def claim(connection, key, job_id):
+    """
+    Register `job_id` as the job computing the inputs hashed to `key`,
+    unless an identical job is in flight.  Returns that job, or None if
+    `job_id` is to be queued.  Of identical submissions arriving together,
+    exactly one is registered; the others follow it.
+    """
+    replace = connection.register_script(REPLACE)
+    while True:
+        if connection.set(PREFIX + key, job_id, nx=True, ex=INFLIGHT_TTL):
+            return None
+        leader_id = connection.get(PREFIX + key)
+        if leader_id is None:
+            # Released in the meantime
+            continue
+        leader_id = leader_id.decode()
+        leader = live_job(connection, leader_id)
+        if leader is not None:
+            return leader
+        queued = connection.exists(Job.key_for(leader_id)) > 0
+        age = INFLIGHT_TTL - connection.ttl(PREFIX + key)
+        if not queued and age < CLAIM_WAIT:
+            # Registered just now, its job is about to be queued
+            time.sleep(CLAIM_POLL)
+            continue
+        # The previous job has ended: take its place, unless another
+        # submission has already
+        if replace(keys=[PREFIX + key], args=[leader_id, job_id, INFLIGHT_TTL]):
+            return None
+
+
+def release(connection, key, job_id):
+    """The job `job_id` no longer computes the inputs hashed to `key`"""
+    connection.register_script(RELEASE)(keys=[PREFIX + key], args=[job_id])
@@ -0,0 +1,183 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from os import getenv
+
+import numpy as np
+from solvers import SeededGa
+
+# Number of GA populations evolved in parallel for one job
+GA_ISLANDS = int(getenv("STARFIT_GA_ISLANDS", 1))
+
+# Number of times the best solutions of each island are passed on to the
+# next one during a run, and how many of them
+GA_MIGRATIONS = int(getenv("STARFIT_GA_MIGRATIONS", 3))
+GA_MIGRANTS = int(getenv("STARFIT_GA_MIGRANTS", 10))
+
+# Ga options and progress of the job being run.  Set before the island
+# processes are forked so that they inherit them (and the databases)
+# instead of having them pickled.
+_options = None
+_progress = None
+
+# What StarFit's set-up (star, trimmed databases, excluded elements) of the
+# job being run added to the search, in this process
+_setup_state = None
+
+
+class IslandGa(SeededGa):
+    """
+    SeededGa that sets up the search once in each process and reuses the
+    set-up for the following epochs of the run
+    """
+
+    def _setup(self, *args, **kwargs):
+        global _setup_state
+        if _setup_state is not None:
+            self.__dict__.update(_setup_state)
+            return
+        before = set(self.__dict__)
+        super()._setup(*args, **kwargs)
+        _setup_state = {k: v for k, v in self.__dict__.items() if k not in before}
+
+
+def evolve(seed, population, time_limit, gen, progress=None):
+    return IslandGa(
+        **_options,
+        seed=seed,
+        population=population,
+        time_limit=time_limit,
+        gen=gen,
+        progress=progress,
+    )
+
+
+def run_island(seed, population, time_limit, gen):
+    # Only island 0 reports progress, the others just stop with it
+    progress = None if _progress is None else _progress.quiet()
+    ga = evolve(seed, population, time_limit, gen, progress)
+    return ga.s, ga.f, ga.history, ga.times, ga.gen
+
+
+def join_history(history, times, new_history, new_times):
+    """Append the history of a continued run, skipping its initial population"""
+    if history is None:
+        return new_history, new_times
+    for key in history:
+        history[key] += new_history[key][1:]
+    times += [times[-1] + t for t in new_times[1:]]
+    return history, times
+
+
+def merge_populations(populations, fitnesses, size):
+    """Best `size` distinct solutions of all populations"""
+    s = np.concatenate(populations)
+    f = np.concatenate(fitnesses)
+    sort = np.argsort(f)
+    s = s[sort]
+    f = f[sort]
+    # Keep the best of solutions that combine the same models
+    idx = np.sort(s["index"], axis=-1)
+    _, unique = np.unique(idx, axis=0, return_index=True)
+    unique = np.sort(unique)[:size]
+    return s[unique], f[unique]
+
+
+def run_islands(
+    options, n_islands=None, n_migrations=None, population=None, progress=None
+):
+    """
+    Run the GA described by `options` (keyword arguments of Ga) as
+    `n_islands` independently seeded populations in parallel, within the
+    same time limit.  The run is split into `n_migrations + 1` epochs; after
+    each, the best solutions of every island migrate to the next one.  The
+    initial populations of all islands start with `population`, if given.
+    Island 0 reports to `progress`; when it is stopped, all islands stop.
+
+    Island 0 runs in this process and its Ga object is returned, with the
+    merged best solutions of all islands and their fitness histories.
+    """
+    global _options, _progress, _setup_state
+
+    if n_islands is None:
+        n_islands = GA_ISLANDS
+    if n_migrations is None:
+        n_migrations = GA_MIGRATIONS
+
+    options = dict(options)
+    seed = options.pop("seed", None)
+    time_limit = options.pop("time_limit")
+    gen = options.pop("gen")
+
+    n_epochs = n_migrations + 1
+    epoch_time = time_limit / n_epochs
+    epoch_gen = int(np.ceil(gen / n_epochs))
+    seeds = np.random.SeedSequence(seed).spawn(n_islands * n_epochs)
+
+    populations = [population] * n_islands
+    histories = [(None, None)] * n_islands
+    generations = [0] * n_islands
+    fitnesses = [None] * n_islands
+
+    time_start = time.perf_counter()
+    _options = options
+    _progress = progress
+    _setup_state = None
+    try:
+        with ProcessPoolExecutor(
+            max_workers=max(1, n_islands - 1), mp_context=get_context("fork")
+        ) as executor:
+            for epoch in range(n_epochs):
+                futures = [
+                    executor.submit(
+                        run_island,
+                        seeds[epoch * n_islands + i],
+                        populations[i],
+                        epoch_time,
+                        epoch_gen,
+                    )
+                    for i in range(1, n_islands)
+                ]
+                if progress is not None:
+                    progress.done = generations[0]
+                ga = evolve(
+                    seeds[epoch * n_islands],
+                    populations[0],
+                    epoch_time,
+                    epoch_gen,
+                    progress,
+                )
+                results = [(ga.s, ga.f, ga.history, ga.times, ga.gen)]
+                results += [f.result() for f in futures]
+
+                for i, (s, f, history, times, n_gen) in enumerate(results):
+                    populations[i] = s
+                    fitnesses[i] = f
+                    histories[i] = join_history(*histories[i], history, times)
+                    generations[i] += n_gen
+
+                if ga.stopped:
+                    break
+
+                # Ring migration: the best solutions of each island replace
+                # the worst of the next one
+                if epoch < n_epochs - 1:
+                    n = min(GA_MIGRANTS, ga.pop_size // 2)
+                    migrants = [s[:n] for s in populations]
+                    for i in range(n_islands):
+                        populations[i] = np.concatenate(
+                            (populations[i][: ga.pop_size - n], migrants[i - 1])
+                        )
+    finally:
+        _options = None
+        _progress = None
+        _setup_state = None
+
+    ga.s, ga.f = merge_populations(populations, fitnesses, ga.pop_size)
+    ga.sorted_stars = ga.s
+    ga.sorted_fitness = ga.f
+    ga.history, ga.times = histories[0]
+    ga.gen = generations[0]
+    ga.islands = histories[1:]
+    ga.elapsed = time.perf_counter() - time_start
+    return ga
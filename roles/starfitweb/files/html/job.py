@@ -1,33 +1,72 @@
+import copy
+import gzip
+import multiprocessing
 import os
-import smtplib
-from email import encoders as Encoders
-from email.mime.base import MIMEBase
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from io import BytesIO
+import shutil
+import sys
+import time
+import traceback
+from os import getenv
 from pathlib import Path
 from socket import gethostname
 
+import artifacts
+import dbcache
+import islands
 import jinja2 as j2
-import matplotlib as mpl
+import mailer
+import metrics
 import numpy as np
-from starfit import Ga, Multi, Single
+import plots
+import progress
+import resultcache
+import routing
+import stacked
+import uploads
+import warmstart
+from rq import Queue, get_current_job
+from rq.job import Dependency, Job
+from solvers import (
+    MergedMulti,
+    PackedGa,
+    PackedMulti,
+    PackedSingle,
+    PlannedMulti,
+    PreparedSingle,
+    ReportingMulti,
+    SeededGa,
+    ShardedMulti,
+)
 from starfit.autils.human import time2human
 from starfit.autils.isotope import ion as I
-from utils import JobInfo, convert_img_to_b64_tag
+from utils import JobInfo, convert_img_to_url_tag
 
 jinja_env = j2.Environment(loader=j2.FileSystemLoader("templates"))
 
-mpl.use("Agg")
-mpl.rc("text", usetex=True)
+# Multi searches of at least this many combinations are split into this many
+# jobs, so that they run on several workers
+MULTI_SHARDS = int(getenv("STARFIT_MULTI_SHARDS", 10))
+MULTI_SHARD_MIN = int(getenv("STARFIT_MULTI_SHARD_MIN", 1000000))
 
+# Estimated time (seconds) to search one block of combinations of a multi
+# search with a deadline.  A search looks at the clock after each block.
+MULTI_BLOCK_TIME = float(getenv("STARFIT_MULTI_BLOCK_TIME", 5))
+
+# Data files (full results, plot data) of at least this many bytes are
+# stored, offered for download and mailed gzip-compressed
+GZIP_MIN = int(getenv("STARFIT_GZIP_MIN", 256 * 1024))
+
+
+def compute(config, multi=PackedMulti, single=PackedSingle, progress=None, **kwargs):
+    with metrics.stage("load"):
+        db = dbcache.load(config.dbpath)
+    metrics.size("models", sum(d.nstar for d in db))
+    metrics.size("db_bytes", sum(dbcache.DBCache.sizeof(d) for d in db))
 
-def compute(config):
     if config.algorithm == "ga":
-        # Run the fitting algorithm
-        result = Ga(
-            filename=config.filepath,
-            db=config.dbpath,
+        options = dict(
+            filename=config.star,
+            db=db,
             silent=True,
             combine=config.combine,
             z_min=config.z_min,
@@ -58,11 +97,30 @@ def compute(config):
             mut_rate_offset=config.mut_rate_offset,
             mut_offset_magnitude=config.mut_offset_magnitude,
             local_search=config.local_search,
+            seed=config.seed,
         )
+        # Start from the solutions of earlier runs, if asked for and found
+        population = getattr(config, "population", None)
+        # Run the fitting algorithm
+        if islands.GA_ISLANDS > 1:
+            result = islands.run_islands(
+                options, population=population, progress=progress
+            )
+        elif population is not None or progress is not None:
+            result = SeededGa(**options, population=population, progress=progress)
+        else:
+            result = PackedGa(**options)
     elif config.algorithm == "multi":
-        result = Multi(
-            filename=config.filepath,
-            db=config.dbpath,
+        options = dict(n_top=1000, save=True, webfile=config.start_time)
+        if kwargs.get("deadline") is not None:
+            block_size = MULTI_BLOCK_TIME * routing.MULTI_RATE / config.sol_size
+            options["block_size"] = int(min(max(block_size, 2**10), 2**17))
+        options.update(kwargs)
+        if progress is not None:
+            options["progress"] = progress
+        result = multi(
+            filename=config.star,
+            db=db,
             silent=True,
             combine=config.combine,
             z_min=config.z_min,
@@ -81,14 +139,12 @@ def compute(config):
             fixed_offsets=config.fixed,
             sol_size=config.sol_sizes,
             group=config.group,
-            n_top=1000,
-            save=True,
-            webfile=config.start_time,
+            **options,
         )
     elif config.algorithm == "single":
-        result = Single(
-            filename=config.filepath,
-            db=config.dbpath,
+        result = single(
+            filename=config.star,
+            db=db,
             silent=True,
             combine=config.combine,
             z_min=config.z_min,
@@ -179,6 +235,18 @@ def set_result_values(result, config):
     )
     config.text_db = result.text_db(filename=True)
     config.text_db_n_columns = str(len(config.text_db[0]))
+    config.stopped_string = ""
+    if getattr(result, "stopped", False):
+        if config.algorithm == "ga":
+            config.stopped_string = (
+                f"{result.stopped}, after {result.gen:,d} generations"
+            )
+        else:
+            config.stopped_string = (
+                f"{result.stopped}, after {result.n_solved:,d} of "
+                f"{result.n_combinations:,d} combinations "
+                f"({100 * result.n_solved / result.n_combinations:.2g} %)"
+            )
     if config.algorithm == "ga":
         config.text_generations = str(result.gen)
         config.text_time = time2human(result.elapsed)
@@ -305,49 +373,46 @@ def set_result_values(result, config):
     config.constraints_ok = result.constraints_ok
 
 
-def make_plots(result, config):
-    # File objects
-    file_obj = []
-
-    # Abundance plot
-    imgfile = BytesIO()
-    labels, plotdata = result.plot(
-        save=imgfile,
-        save_format=config.plotformat,
-        return_plot_data=True,
-        yscale=config.yscale,
-        ynorm="Fe",
-        multi=config.multi,
+def data_files(config):
+    """Attachment names and paths of the data files written by a job"""
+    files = list()
+    if config.algorithm == "multi":
+        files.append(("full_results.txt", os.path.join("/tmp", config.start_time)))
+    files.append(
+        (
+            f"plot_data_points_{config.filename}.txt",
+            os.path.join("/tmp", "plot_data_points" + config.start_time),
+        )
     )
-    file_obj += [imgfile]
-
-    if config.algorithm == "ga":
-        result.plot_fitness(gen=True)
-        imgfile = BytesIO()
-        mpl.pyplot.savefig(imgfile, format=config.plotformat)
-        file_obj += [imgfile]
-
-    if config.plot_cov:
-        result.plot_error_matrix(zoom=False)
-        imgfile = BytesIO()
-        mpl.pyplot.savefig(imgfile, format=config.plotformat)
-        file_obj += [imgfile]
-
-    # Save plot data to ASCII file
-    plotdatafile = os.path.join("/tmp", "plot_data_points" + config.start_time)
-    with open(plotdatafile, mode="w") as f:
-        for l in labels:
-            f.write(f"{l}\n")
-        f.write("\n")
-        f.write("Z      log(X/X_sun)\n")
-        for z, abu in zip(plotdata[0], plotdata[1]):
-            f.write(f"{z:<2}     {abu:7.5f}\n")
-
-    return file_obj
-
-
-def render(config, result, img_tags, doc, jobinfo):
-    if doc in ("configerror", "resultpage", "sendmail", "jobfail", "email"):
+    return files
+
+
+def pack_data_file(filename, path):
+    """
+    Compress a data file if it is large.  Returns its attachment name and
+    path.
+    """
+    if os.path.getsize(path) < GZIP_MIN:
+        return filename, path
+    with open(path, "rb") as src, gzip.open(path + ".gz", "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.unlink(path)
+    return filename + ".gz", path + ".gz"
+
+
+def render(config, result, img_tags, doc, jobinfo, fragment=None, downloads=()):
+    if doc in (
+        "configerror",
+        "resultpage",
+        "sendmail",
+        "jobfail",
+        "email",
+        "result",
+        "pending",
+        "quota",
+        "fit",
+        "batch",
+    ):
         template = jinja_env.get_template(f"{doc}.html")
     else:
         raise RuntimeError("Bad choice of 'doc'")
@@ -357,100 +422,590 @@ def render(config, result, img_tags, doc, jobinfo):
         result=result,
         img_tags=img_tags,
         jobinfo=jobinfo,
+        fragment=fragment,
+        downloads=downloads,
         hostname=gethostname(),
     )
 
 
-def send_email(config, body, imgfiles):
-    session = smtplib.SMTP(gethostname())
-    sender = f"results@{gethostname()}"
-    mailto = (
-        "starfit.results@gmail.com?subject=Unsubscribe&body=%5BAutomated"
-        "%20message%5D%0D%0APlease%20unsubscribe%20me%20from%20all%20future%20emails."
+def store_results(config, job_id, fragment, imgfiles, datafiles, connection=None):
+    """
+    Write the results of a job to its artifact directory and return the
+    manifest describing them.
+    """
+    plots = list()
+    for i, imgfile in enumerate(imgfiles):
+        name = f"plot-{i:d}.{config.plotformat}"
+        artifacts.save(job_id, name, imgfile.getvalue())
+        plots.append(name)
+
+    files = list()
+    for i, (filename, path) in enumerate(datafiles):
+        name = f"data-{i:d}.txt"
+        if filename.endswith(".gz"):
+            name += ".gz"
+        artifacts.copy(job_id, name, path)
+        files.append((filename, name))
+
+    artifacts.save(job_id, "star.dat", uploads.read(connection, config))
+    artifacts.save(job_id, "fragment.html", fragment)
+
+    return dict(
+        job_id=job_id,
+        plotformat=config.plotformat,
+        plots=plots,
+        files=files,
+        star=(config.filename, "star.dat"),
+        fragment="fragment.html",
     )
 
-    msg = MIMEMultipart()
-    msg["From"] = f"StarFit <{sender}>"
-    msg["To"] = config.email
-    msg["Bcc"] = "starfit.results@gmail.com"
-    msg["Subject"] = "StarFit Results"
-    msg.add_header(
-        "List-Unsubscribe",
-        f"<mailto:{mailto}>, <https://{gethostname()}/unsubscribe>",
+
+def result_page(config, manifest):
+    """Render the result page of a finished job from its artifacts"""
+    job_id = manifest["job_id"]
+    img_tags = [
+        convert_img_to_url_tag(artifacts.url(job_id, name), manifest["plotformat"])
+        for name in manifest["plots"]
+    ]
+    downloads = [
+        (filename, artifacts.url(job_id, name)) for filename, name in manifest["files"]
+    ]
+    fragment = artifacts.read(job_id, manifest["fragment"])
+
+    return render(
+        config,
+        None,
+        img_tags,
+        doc="resultpage",
+        jobinfo=JobInfo(),
+        fragment=fragment,
+        downloads=downloads,
     )
 
-    msg.attach(MIMEText(body, "html"))
 
-    # Attach images
-    part = MIMEBase("application", "octet-stream")
-    part.set_payload(imgfiles[0].getvalue())
-    Encoders.encode_base64(part)
-    part.add_header(
-        "Content-Disposition",
-        f'attachment; filename="abundance_plot.{config.plotformat}"',
+def finish_job(config, fragment, imgfiles, datafiles, job_id, connection=None):
+    """Store the results and queue the results mail if requested"""
+    with metrics.stage("store"):
+        manifest = store_results(
+            config, job_id, fragment, imgfiles, datafiles, connection=connection
+        )
+
+    if config.mail:  # Send an email with the results
+        with metrics.stage("mail"):
+            email = render(
+                config, None, [], doc="email", jobinfo=JobInfo(), fragment=fragment
+            )
+            mailer.queue_mail(config, manifest, email, connection)
+
+    return manifest
+
+
+def report(config, result, job):
+    """Plot, cache, store and mail the result of a job"""
+    with metrics.stage("values"):
+        set_star_values(result, config)
+        set_result_values(result, config)
+    with metrics.stage("plots"):
+        imgfiles = plots.make_plots(result, config)
+    datafiles = [
+        pack_data_file(filename, path) for filename, path in data_files(config)
+    ]
+    metrics.size("plot_bytes", sum(len(f.getvalue()) for f in imgfiles))
+    metrics.size("data_bytes", sum(os.path.getsize(path) for _, path in datafiles))
+
+    with metrics.stage("render"):
+        fragment = render(config, result, [], doc="result", jobinfo=JobInfo())
+
+    if getattr(config, "cache_key", None) is not None:
+        with metrics.stage("cache"):
+            resultcache.put(
+                config.cache_key,
+                fragment,
+                [f.getvalue() for f in imgfiles],
+                datafiles,
+                config.plotformat,
+            )
+
+    return finish_job(
+        config, fragment, imgfiles, datafiles, job.id, connection=job.connection
     )
-    msg.attach(part)
 
-    if config.algorithm == "ga":
-        part = MIMEBase("application", "octet-stream")
-        part.set_payload(imgfiles[1].getvalue())
-        Encoders.encode_base64(part)
-        part.add_header(
-            "Content-Disposition",
-            f'attachment; filename="ga_fitness_plot.{config.plotformat}"',
-        )
-        msg.attach(part)
 
-    # Attach big numbers
-    if config.algorithm == "multi":
-        part = MIMEBase("application", "octet-stream")
-        part.set_payload(open(os.path.join("/tmp", config.start_time), "rb").read())
-        Encoders.encode_base64(part)
-        part.add_header(
-            "Content-Disposition",
-            'attachment; filename="full_results.txt"',
+def cleanup_files(config):
+    for _, path in data_files(config):
+        Path(path).unlink(missing_ok=True)
+        Path(path + ".gz").unlink(missing_ok=True)
+
+
+def cleanup_job(config, connection):
+    if config.batch is None:
+        cleanup_files(config)
+    # Jobs from the web application have their star files in the upload store
+    uploads.release_job(connection, config)
+
+
+def best_model(result, config, format):
+    """Fitness and a one-line description of the best fitting model"""
+    text = result.text_result(1, format=format, show_index=config.show_index)
+    model = list()
+    for line in text[2:]:
+        if line == "":
+            continue
+        model.append(
+            ", ".join(
+                f"{head} {word.strip()}"
+                for head, word in zip(text[0][1:], line[1:])
+                if word.strip() != ""
+            )
+        )
+    return text[2][0], "; ".join(model)
+
+
+def star_config(config, member, i):
+    """Settings of the job for one star of a batch"""
+    star_config = copy.copy(config)
+    star_config.batch = None
+    star_config.filename = member.filename
+    star_config.star = member.star
+    star_config.star_data = member.star_data
+    star_config.star_hash = member.star_hash
+    star_config.start_time = f"{config.start_time}-{i:d}"
+    return star_config
+
+
+def fit_stack(configs):
+    """
+    Set up the single searches of a stack of batch stars and evaluate them
+    together.  Returns the searches, or None for the stars to be fitted on
+    their own.
+    """
+    searches = list()
+    for config in configs:
+        try:
+            with metrics.stage("fit"):
+                searches.append(compute(config, single=PreparedSingle))
+        except:
+            traceback.print_exc(file=sys.stderr)
+            searches.append(None)
+    try:
+        with metrics.stage("fit"):
+            stacked.fit_stack([search for search in searches if search is not None])
+    except:
+        traceback.print_exc(file=sys.stderr)
+        searches = [None] * len(configs)
+    return searches
+
+
+def fit_batch_star(config, job_id, i, connection, result=None):
+    """
+    Fit and plot one star of a batch, and store its plots and files.
+    Returns its section of the result page.
+    """
+    try:
+        if result is None:
+            if config.algorithm == "ga":
+                start_warm(config, connection)
+            with metrics.stage("fit"):
+                result = compute(config)
+            if config.algorithm == "ga":
+                keep_warm(config, result, connection)
+        with metrics.stage("values"):
+            set_star_values(result, config)
+            set_result_values(result, config)
+        with metrics.stage("plots"):
+            imgfiles = plots.make_plots(result, config)
+        with metrics.stage("render"):
+            fragment = render(config, result, [], doc="fit", jobinfo=JobInfo())
+
+        with metrics.stage("store"):
+            plot_names = list()
+            for k, imgfile in enumerate(imgfiles):
+                name = f"star-{i:d}-plot-{k:d}.{config.plotformat}"
+                artifacts.save(job_id, name, imgfile.getvalue())
+                plot_names.append(name)
+
+            files = list()
+            for k, (filename, path) in enumerate(data_files(config)):
+                filename, path = pack_data_file(filename, path)
+                name = f"star-{i:d}-data-{k:d}.txt"
+                if filename.endswith(".gz"):
+                    name += ".gz"
+                artifacts.copy(job_id, name, path)
+                files.append((f"{i + 1:03d}_{filename}", name))
+            name = f"star-{i:d}.dat"
+            artifacts.save(job_id, name, uploads.read(connection, config))
+            files.append((f"{i + 1:03d}_{config.filename}", name))
+
+        fitness, model = best_model(result, config, "html")
+        text_fitness, text_model = best_model(result, config, "plain")
+        return dict(
+            filename=config.filename,
+            name=result.star.name,
+            fitness=fitness,
+            model=model,
+            text=f"{config.filename}\t{result.star.name}\t{text_fitness}\t{text_model}",
+            fragment=fragment,
+            plots=plot_names,
+            files=files,
+        )
+    except:
+        traceback.print_exc(file=sys.stderr)
+        return dict(
+            filename=config.filename,
+            error="The fit of this star failed.",
+            text=f"{config.filename}\t\t\tfailed",
+            plots=[],
+            files=[],
         )
-        msg.attach(part)
+    finally:
+        cleanup_files(config)
+
+
+def run_batch(config, job):
+    """
+    Fit each star of a batch with the same settings and databases, and
+    store a summary of the best fits with a section for each star.  Single
+    searches are evaluated a stack of stars at a time (`stacked.py`), the
+    other searches one star after the other.
+    """
+    configs = [star_config(config, member, i) for i, member in enumerate(config.batch)]
+    sections = list()
+    for start in range(0, len(configs), stacked.STACK_SIZE):
+        if job.connection is not None and not config.mail:
+            if progress.abandoned(job.connection, job.id):
+                progress.request_cancel(job.connection, job.id)
+        if job.connection is not None and progress.canceled(job.connection, job.id):
+            raise RuntimeError("The job was canceled, its results were not collected")
+        end = start + stacked.STACK_SIZE
+        stack = configs[start:end]
+        if config.algorithm == "single":
+            results = fit_stack(stack)
+        else:
+            results = [None] * len(stack)
+        for i, (member_config, result) in enumerate(zip(stack, results), start):
+            sections.append(
+                fit_batch_star(member_config, job.id, i, job.connection, result)
+            )
 
-    # Attach plot data
-    part = MIMEBase("application", "octet-stream")
-    part.set_payload(
-        open(os.path.join("/tmp", "plot_data_points" + config.start_time), "rb").read()
-    )
-    Encoders.encode_base64(part)
-    part.add_header(
-        "Content-Disposition",
-        f'attachment; filename="plot_data_points_{config.filename}.txt"',
+    summary = ["star file\tname\tchi**2\tbest fitting model"]
+    summary.extend(section["text"] for section in sections)
+    artifacts.save(job.id, "summary.txt", "\n".join(summary) + "\n")
+
+    # The result page shows the plots of each star in its (closed) section,
+    # loaded by the browser when it is opened; the mail only attaches the
+    # abundance plots
+    with metrics.stage("render"):
+        config.batch_sections = sections
+        for section in sections:
+            section["img_tags"] = list()
+        mail_fragment = render(config, None, [], doc="batch", jobinfo=JobInfo())
+        for section in sections:
+            section["img_tags"] = [
+                convert_img_to_url_tag(artifacts.url(job.id, name), config.plotformat)
+                for name in section["plots"]
+            ]
+        fragment = render(config, None, [], doc="batch", jobinfo=JobInfo())
+    artifacts.save(job.id, "fragment.html", fragment)
+
+    files = [("batch_summary.txt", "summary.txt")]
+    for section in sections:
+        files.extend(section["files"])
+    manifest = dict(
+        job_id=job.id,
+        plotformat=config.plotformat,
+        plots=[],
+        files=files,
+        star=None,
+        fragment="fragment.html",
+        batch=[
+            (section["filename"], section["plots"][0])
+            for section in sections
+            if len(section["plots"]) > 0
+        ],
     )
-    msg.attach(part)
-
-    # Attach input data
-    if config.filename:
-        part = MIMEBase("application", "octet-stream")
-        part.set_payload(open(config.filepath, "rb").read())
-        Encoders.encode_base64(part)
-        part.add_header(
-            "Content-Disposition",
-            f'attachment; filename="{config.filename}"',
-        )
-        msg.attach(part)
 
-    # Send!
-    session.sendmail(sender, config.email, msg.as_string())
+    if config.mail:
+        with metrics.stage("mail"):
+            email = render(
+                config,
+                None,
+                [],
+                doc="email",
+                jobinfo=JobInfo(),
+                fragment=mail_fragment,
+            )
+            mailer.queue_mail(config, manifest, email, job.connection)
+
+    return manifest
 
 
-def run_job(config):
-    result = compute(config)
-    set_star_values(result, config)
-    set_result_values(result, config)
-    imgfiles = make_plots(result, config)
-    img_tags = [convert_img_to_b64_tag(f, config.plotformat) for f in imgfiles]
-    jobinfo = JobInfo()
+def run_job(config, job=None):
+    if job is None:
+        job = get_current_job()
 
-    page = render(config, result, img_tags, doc="resultpage", jobinfo=jobinfo)
-    email = render(config, result, img_tags, doc="email", jobinfo=jobinfo)
+    if config.batch is not None:
+        try:
+            return run_batch(config, job)
+        finally:
+            cleanup_job(config, job.connection)
 
-    if config.mail:  # Send an email with the results
-        send_email(config, email, imgfiles)
+    # Multi searches stop at their time limit, counted from here
+    deadline = None
+    if config.algorithm == "multi":
+        deadline = time.time() + config.time_limit
+
+    if config.algorithm == "multi" and MULTI_SHARDS > 1:
+        # Set up the search to see whether it is worth splitting
+        try:
+            with metrics.stage("plan"):
+                plan = compute(config, multi=PlannedMulti, save=False)
+        except:
+            cleanup_job(config, job.connection)
+            raise
+        if plan.n_combinations >= MULTI_SHARD_MIN:
+            return split_job(config, job, MULTI_SHARDS, deadline)
 
-    return page
+    if config.algorithm == "ga":
+        start_warm(config, job.connection)
+
+    try:
+        with metrics.stage("fit"):
+            result = compute(
+                config,
+                multi=ReportingMulti,
+                progress=track(config, job.id, job.connection),
+                deadline=deadline,
+            )
+        check_canceled(result)
+        if config.algorithm == "ga":
+            keep_warm(config, result, job.connection)
+        if getattr(result, "stopped", False):
+            # Only the results of complete searches are reused
+            config.cache_key = None
+        return report(config, result, job)
+    finally:
+        cleanup_job(config, job.connection)
+        if job.connection is not None:
+            progress.clear(job.connection, job.id)
+
+
+def check_canceled(result):
+    """Fail a job whose search ended because it was canceled"""
+    if getattr(result, "stopped", False) == progress.CANCELED:
+        raise RuntimeError("The job was canceled, its results were not collected")
+
+
+def track(config, job_id, connection, part=0):
+    """
+    Progress of (part `part` of) the GA or multi search of the job
+    `job_id`, or None for other searches.  Searches whose results are
+    not mailed end when the job is abandoned.
+    """
+    if connection is None:
+        return None
+    leased = not config.mail
+    if config.algorithm == "ga":
+        return progress.Progress(
+            connection,
+            job_id,
+            part,
+            total=config.gen,
+            time_limit=config.time_limit,
+            leased=leased,
+        )
+    if config.algorithm == "multi":
+        return progress.Progress(connection, job_id, part, leased=leased)
+    return None
+
+
+def start_warm(config, connection):
+    """Look up the solutions of earlier runs if the job asks for a warm start"""
+    config.population = None
+    config.warm_start_string = "no earlier runs"
+    if not config.warm_start or connection is None:
+        return
+    try:
+        population = warmstart.get(connection, config)
+    except:
+        traceback.print_exc(file=sys.stderr)
+        return
+    if population is not None:
+        # Leave room for new solutions
+        config.population = population[: max(1, config.pop_size // 2)]
+        config.warm_start_string = (
+            f"{len(config.population):d} solutions of earlier runs"
+        )
+        metrics.size("warm_start", len(config.population))
+
+
+def keep_warm(config, result, connection):
+    """Keep the best solutions of a GA run for later warm starts"""
+    if connection is None:
+        return
+    try:
+        warmstart.put(connection, config, result.sorted_stars[: warmstart.WARM_SIZE])
+    except:
+        traceback.print_exc(file=sys.stderr)
+
+
+def follow(connection, config, leader, queue, **options):
+    """
+    Queue a job that serves the result of the identical job `leader` to
+    another submitter, once `leader` has ended
+    """
+    options.setdefault("meta", dict())["follows"] = leader.id
+    q = Queue(queue, connection=connection)
+    return q.enqueue_call(
+        follow_job,
+        args=(config, leader.id),
+        depends_on=Dependency(jobs=[leader], allow_failure=True),
+        **options,
+    )
+
+
+def follow_job(config, leader_id):
+    """
+    Return the manifest of the identical job `leader_id` as the result of
+    this job, and mail it if this submitter asked for it
+    """
+    job = get_current_job()
+    leader = Job.fetch(leader_id, connection=job.connection)
+    if "continued_by" in leader.meta:
+        # Wait for the job that continues a split search
+        continued = Job.fetch(leader.meta["continued_by"], connection=job.connection)
+        follower = follow(
+            job.connection,
+            config,
+            continued,
+            job.origin,
+            result_ttl=job.result_ttl,
+            failure_ttl=job.failure_ttl,
+            description=job.description,
+            job_id=f"{job.id}__follow",
+            meta=dict(job.meta),
+        )
+        job.meta["continued_by"] = follower.id
+        job.save_meta()
+        return None
+
+    if leader.get_status() != "finished":
+        raise RuntimeError(f"The identical job {leader_id} did not finish")
+    manifest = leader.return_value()
+
+    if config.mail:
+        with metrics.stage("mail"):
+            fragment = artifacts.read(manifest["job_id"], manifest["fragment"])
+            email = render(
+                config, None, [], doc="email", jobinfo=JobInfo(), fragment=fragment
+            )
+            mailer.queue_mail(
+                config, manifest, email, job.connection, name=f"mail-{job.id}"
+            )
+
+    return manifest
+
+
+def split_job(config, job, n_shards, deadline=None):
+    """
+    Run a multi search as `n_shards` jobs, followed by a job that merges
+    their results.  The status page follows `job` to the merge job.  All
+    parts stop at `deadline`.
+    """
+    q = Queue(job.origin, connection=job.connection, default_timeout=job.timeout)
+    threads = max(1, multiprocessing.cpu_count() // n_shards)
+    shards = [
+        q.enqueue_call(
+            run_shard,
+            args=(config, i, n_shards, threads, job.id, deadline),
+            result_ttl=86400,
+            failure_ttl=86400,
+            description=f"Part {i + 1:d} of {n_shards:d} of {job.id}",
+            job_id=f"{job.id}__{i:d}",
+        )
+        for i in range(n_shards)
+    ]
+    merge = q.enqueue_call(
+        merge_shards,
+        args=(config, job.id),
+        depends_on=Dependency(jobs=shards, allow_failure=True),
+        result_ttl=job.result_ttl,
+        failure_ttl=job.failure_ttl,
+        description=job.description,
+        job_id=f"{job.id}__merge",
+        meta=job.meta,
+    )
+    job.meta["continued_by"] = merge.id
+    job.save_meta()
+
+
+def run_shard(config, shard, n_shards, threads, parent_id=None, deadline=None):
+    """
+    Search part `shard` of a split multi search.  Parts report their
+    progress, and are stopped, as parts of the job `parent_id`, and stop
+    at `deadline`.
+    """
+    job = get_current_job()
+    if deadline is not None and time.time() >= deadline:
+        return dict(stopped="time limit reached", n_solved=0)
+    tracker = None
+    if parent_id is not None:
+        if progress.canceled(job.connection, parent_id):
+            raise RuntimeError("The job was canceled before this part started")
+        if progress.stopping(job.connection, parent_id):
+            return dict(stopped=progress.ON_REQUEST, n_solved=0)
+        tracker = track(config, parent_id, job.connection, part=shard)
+    with metrics.stage("fit"):
+        result = compute(
+            config,
+            multi=ShardedMulti,
+            progress=tracker,
+            deadline=deadline,
+            shard=shard,
+            n_shards=n_shards,
+            threads=threads,
+            save=False,
+        )
+    check_canceled(result)
+    found = np.isfinite(result.top_fitness)
+    return dict(
+        top_stars=result.top_stars[found],
+        top_fitness=result.top_fitness[found],
+        stopped=result.stopped,
+        n_solved=int(result.n_solved),
+    )
+
+
+def merge_shards(config, parent_id=None):
+    job = get_current_job()
+    try:
+        shards = Job.fetch_many(job.dependency_ids, connection=job.connection)
+        failed = [
+            shard_id
+            for shard_id, shard in zip(job.dependency_ids, shards)
+            if shard is None or shard.get_status() != "finished"
+        ]
+        if len(failed) > 0:
+            raise RuntimeError(f"Parts of the search failed: {', '.join(failed)}")
+
+        results = [shard.return_value() for shard in shards]
+        # Parts that were stopped before they started have no results
+        searched = [r for r in results if "top_stars" in r]
+        if len(searched) == 0:
+            raise RuntimeError("No part of the search ran before it was stopped")
+        with metrics.stage("merge"):
+            result = compute(
+                config,
+                multi=MergedMulti,
+                top_stars=[r["top_stars"] for r in searched],
+                top_fitness=[r["top_fitness"] for r in searched],
+            )
+        stopped = [r["stopped"] for r in results if r.get("stopped", False)]
+        result.stopped = stopped[0] if len(stopped) > 0 else False
+        result.n_solved = sum(r.get("n_solved", 0) for r in results)
+        if result.stopped:
+            config.cache_key = None
+        return report(config, result, job)
+    finally:
+        cleanup_job(config, job.connection)
+        if parent_id is not None and job.connection is not None:
+            progress.clear(job.connection, parent_id)
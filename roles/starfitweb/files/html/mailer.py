@@ -0,0 +1,260 @@
+import base64
+import json
+import smtplib
+import sys
+import time
+import traceback
+from email.policy import compat32
+from email.utils import formatdate
+from os import getenv
+from pathlib import Path
+from socket import gethostname
+from uuid import uuid4
+
+import artifacts
+from redis import Redis
+from rq import Queue, Retry
+from rq.worker import SimpleWorker
+
+SMTP_HOST = getenv("STARFIT_SMTP_HOST", gethostname())
+SMTP_PORT = int(getenv("STARFIT_SMTP_PORT", 25))
+
+# An open SMTP connection is reused for consecutive messages, up to this
+# many messages or this many seconds since the last one
+SMTP_MAX_MESSAGES = 100
+SMTP_MAX_IDLE = 60
+
+# Delays between delivery attempts (s)
+RETRY_INTERVALS = [10, 30, 60, 300, 900, 3600]
+
+MAILTO = (
+    "starfit.results@gmail.com?subject=Unsubscribe&body=%5BAutomated"
+    "%20message%5D%0D%0APlease%20unsubscribe%20me%20from%20all%20future%20emails."
+)
+
+
+def queue_mail(config, manifest, body, connection=None, name="mail"):
+    """
+    Queue the delivery of a result mail.  The attachments are taken from the
+    artifacts of the job described by `manifest`, where the mail is stored
+    as `name`.html and `name`.json.
+    """
+    job_id = manifest["job_id"]
+    plots = manifest["plots"]
+
+    if "batch" in manifest:
+        # The summary and the abundance plot of each star of a batch; the
+        # other files are offered on the result page
+        attachments = manifest["files"][:1]
+        attachments.extend(
+            (f"abundance_plot_{Path(filename).stem}.{config.plotformat}", plot)
+            for filename, plot in manifest["batch"]
+        )
+    else:
+        attachments = [(f"abundance_plot.{config.plotformat}", plots[0])]
+        if config.algorithm == "ga":
+            attachments.append((f"ga_fitness_plot.{config.plotformat}", plots[1]))
+
+        # Big numbers and plot data
+        attachments.extend(manifest["files"])
+
+        # Input data
+        attachments.append(manifest["star"])
+
+    artifacts.save(job_id, f"{name}.html", body)
+    artifacts.save(
+        job_id,
+        f"{name}.json",
+        json.dumps(dict(to=config.email, body=f"{name}.html", attachments=attachments)),
+    )
+
+    if connection is None:
+        connection = Redis()
+    q = Queue("mail", connection=connection)
+    return q.enqueue_call(
+        deliver,
+        args=(job_id, name),
+        result_ttl=0,
+        failure_ttl=86400,
+        description=f"StarFit results mail to: {config.email}",
+        retry=Retry(max=len(RETRY_INTERVALS), interval=RETRY_INTERVALS),
+    )
+
+
+# Headers are folded as by `Message.as_string`, with CRLF line ends
+policy = compat32.clone(linesep="\r\n")
+
+# Attachments are read and base64-encoded this many bytes at a time (a
+# multiple of the 57 bytes encoded on each 76-character line)
+CHUNK_SIZE = 57 * 1024
+
+
+def write_part(out, boundary, headers, path):
+    """Write one base64-encoded part of a multipart message"""
+    out.write(f"--{boundary}\r\n".encode())
+    for name, value in headers:
+        out.write(policy.fold_binary(name, value))
+    out.write(b"Content-Transfer-Encoding: base64\r\n\r\n")
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            out.write(base64.encodebytes(chunk).replace(b"\n", b"\r\n"))
+
+
+def write_message(mail, path, out):
+    """
+    Write the result mail to the binary file `out`, one attachment and one
+    chunk at a time, so that large attachments are never held in memory.
+    """
+    sender = f"results@{gethostname()}"
+    boundary = f"===============starfit-{uuid4().hex}=="
+
+    for name, value in (
+        ("From", f"StarFit <{sender}>"),
+        ("To", mail["to"]),
+        ("Bcc", "starfit.results@gmail.com"),
+        ("Subject", "StarFit Results"),
+        (
+            "List-Unsubscribe",
+            f"<mailto:{MAILTO}>, <https://{gethostname()}/unsubscribe>",
+        ),
+        ("Date", formatdate(localtime=True)),
+        ("MIME-Version", "1.0"),
+        ("Content-Type", f'multipart/mixed; boundary="{boundary}"'),
+    ):
+        out.write(policy.fold_binary(name, value))
+    out.write(b"\r\n")
+
+    write_part(
+        out,
+        boundary,
+        [("Content-Type", 'text/html; charset="utf-8"')],
+        path / mail["body"],
+    )
+    for filename, name in mail["attachments"]:
+        write_part(
+            out,
+            boundary,
+            [
+                ("Content-Type", "application/octet-stream"),
+                ("Content-Disposition", f'attachment; filename="{filename}"'),
+            ],
+            path / name,
+        )
+    out.write(f"--{boundary}--\r\n".encode())
+
+    return sender
+
+
+class SMTPPool(object):
+    """A single SMTP connection that is kept open between deliveries"""
+
+    def __init__(self, host=SMTP_HOST, port=SMTP_PORT):
+        self.host = host
+        self.port = port
+        self.session = None
+        self.n_sent = 0
+        self.last_used = 0
+
+    def connect(self):
+        # Start over on a fresh connection every so often
+        idle = time.time() - self.last_used
+        if self.n_sent >= SMTP_MAX_MESSAGES or idle > SMTP_MAX_IDLE:
+            self.close()
+        if self.session is None:
+            self.session = smtplib.SMTP(self.host, self.port, timeout=60)
+            self.n_sent = 0
+        return self.session
+
+    def close(self):
+        if self.session is not None:
+            try:
+                self.session.quit()
+            except:
+                pass
+        self.session = None
+
+    @staticmethod
+    def send_data(session, sender, to, message):
+        """
+        Like `smtplib.SMTP.sendmail`, but reads the message from the file
+        `message` (with CRLF line ends) while it is sent
+        """
+        session.ehlo_or_helo_if_needed()
+        code, reply = session.mail(sender)
+        if code != 250:
+            session.rset()
+            raise smtplib.SMTPSenderRefused(code, reply, sender)
+        code, reply = session.rcpt(to)
+        if code not in (250, 251):
+            session.rset()
+            raise smtplib.SMTPRecipientsRefused({to: (code, reply)})
+        session.putcmd("data")
+        code, reply = session.getreply()
+        if code != 354:
+            session.rset()
+            raise smtplib.SMTPDataError(code, reply)
+
+        with open(message, "rb") as f:
+            buffer = list()
+            size = 0
+            for line in f:
+                # Lines starting with a dot are escaped (RFC 5321 4.5.2)
+                if line.startswith(b"."):
+                    line = b"." + line
+                buffer.append(line)
+                size += len(line)
+                if size >= CHUNK_SIZE:
+                    session.send(b"".join(buffer))
+                    buffer.clear()
+                    size = 0
+            buffer.append(b".\r\n")
+            session.send(b"".join(buffer))
+        code, reply = session.getreply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, reply)
+
+    def sendmail(self, sender, to, message):
+        # A connection that was closed by the server is only noticed when it
+        # is used, so try once more on a fresh one
+        for attempt in range(2):
+            session = self.connect()
+            try:
+                self.send_data(session, sender, to, message)
+                break
+            except (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError):
+                self.close()
+                if attempt > 0:
+                    raise
+        self.n_sent += 1
+        self.last_used = time.time()
+
+
+pool = SMTPPool()
+
+
+def deliver(job_id, name="mail"):
+    path = artifacts.ARTIFACT_DIR / job_id
+    with open(path / f"{name}.json", "r") as f:
+        mail = json.load(f)
+
+    message = path / f"{name}.eml"
+    try:
+        with open(message, "wb") as out:
+            sender = write_message(mail, path, out)
+        pool.sendmail(sender, mail["to"], message)
+    except smtplib.SMTPRecipientsRefused:
+        # Retrying will not help
+        traceback.print_exc(file=sys.stderr)
+    finally:
+        message.unlink(missing_ok=True)
+
+
+class MailWorker(SimpleWorker):
+    """
+    Worker for the mail queue.  Deliveries run in the worker process itself,
+    so the SMTP connection in `pool` is shared by consecutive messages.
+    """
+
+    def teardown(self):
+        pool.close()
+        super().teardown()
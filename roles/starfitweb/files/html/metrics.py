@@ -0,0 +1,208 @@
+import json
+import sys
+import time
+import traceback
+from contextlib import contextmanager
+from os import getenv
+
+from rq import Queue, Worker
+from rq.registry import ScheduledJobRegistry, StartedJobRegistry
+from rq.utils import now
+
+# Queues reported by the metrics endpoint
+QUEUES = ("interactive", "standard", "batch", "mail")
+
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900, 3600)
+
+# Number of per-job records kept in the `starfit:metrics:jobs` list
+METRICS_HISTORY = int(getenv("STARFIT_METRICS_HISTORY", 10000))
+
+PREFIX = "starfit:metrics:"
+
+# Record of the job being run by this worker process, and the time spent in
+# the nested stages of each open stage
+_record = None
+_inner = list()
+
+
+def begin(job):
+    """Start recording the stages of `job`"""
+    global _record
+    config = job.args[0] if len(job.args) > 0 else None
+    wait = None
+    if job.enqueued_at is not None:
+        wait = (now() - job.enqueued_at).total_seconds()
+    _record = dict(
+        job_id=job.id,
+        func=job.func_name.split(".")[-1],
+        algorithm=getattr(config, "algorithm", "none"),
+        queue=job.origin,
+        start=time.time(),
+        wait=wait,
+        stages=dict(),
+        sizes=dict(),
+    )
+    _inner.clear()
+
+
+@contextmanager
+def stage(name):
+    """
+    Time a stage of the current job.  Stages may be nested; the time of a
+    nested stage is not counted again in the enclosing one.
+    """
+    if _record is None:
+        yield
+        return
+    start = time.perf_counter()
+    _inner.append(0.0)
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        exclusive = elapsed - _inner.pop()
+        stages = _record["stages"]
+        stages[name] = stages.get(name, 0.0) + exclusive
+        if len(_inner) > 0:
+            _inner[-1] += elapsed
+
+
+def size(name, value):
+    """Record a size (models, bytes) of the current job"""
+    if _record is not None:
+        _record["sizes"][name] = int(value)
+
+
+def finish(status):
+    """Stop recording and return the record of the current job"""
+    global _record
+    record = _record
+    _record = None
+    if record is not None:
+        record["status"] = getattr(status, "value", str(status))
+        record["total"] = time.time() - record["start"]
+    return record
+
+
+def end(job, status):
+    """Store the record of `job` in its meta and in the Redis time series"""
+    record = finish(status)
+    if record is None:
+        return
+    try:
+        job.meta["metrics"] = record
+        job.save_meta()
+        save(job.connection, record)
+    except:
+        traceback.print_exc(file=sys.stderr)
+
+
+def observe(pipe, name, labels, value):
+    key = PREFIX + name + ":" + ",".join(f"{k}={v}" for k, v in labels)
+    for bound in BUCKETS:
+        if value <= bound:
+            pipe.hincrbyfloat(key, str(bound), 1)
+    pipe.hincrbyfloat(key, "+Inf", 1)
+    pipe.hincrbyfloat(key, "sum", value)
+
+
+def save(connection, record):
+    algorithm = record["algorithm"]
+    pipe = connection.pipeline()
+    pipe.lpush(PREFIX + "jobs", json.dumps(record))
+    pipe.ltrim(PREFIX + "jobs", 0, METRICS_HISTORY - 1)
+    pipe.hincrby(
+        PREFIX + "jobs_total", f"algorithm={algorithm},status={record['status']}", 1
+    )
+    if record["wait"] is not None:
+        observe(
+            pipe,
+            "wait_seconds",
+            [("queue", record["queue"]), ("algorithm", algorithm)],
+            record["wait"],
+        )
+    for name, value in record["stages"].items():
+        observe(
+            pipe, "stage_seconds", [("algorithm", algorithm), ("stage", name)], value
+        )
+    for name, value in record["sizes"].items():
+        pipe.hincrby(PREFIX + "size_total", f"algorithm={algorithm},size={name}", value)
+    pipe.execute()
+
+
+def label_string(labels):
+    """`a=1,b=2` as Prometheus labels"""
+    if len(labels) == 0:
+        return ""
+    pairs = [pair.split("=", 1) for pair in labels.split(",")]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+def exposition(connection):
+    """All metrics in the Prometheus text format"""
+    lines = list()
+
+    def family(name, kind, text):
+        lines.append(f"# HELP starfit_{name} {text}")
+        lines.append(f"# TYPE starfit_{name} {kind}")
+
+    family("queue_jobs", "gauge", "Jobs waiting in a queue.")
+    for name in QUEUES:
+        count = Queue(name, connection=connection).count
+        lines.append(f'starfit_queue_jobs{{queue="{name}"}} {count:d}')
+    family("queue_scheduled_jobs", "gauge", "Jobs deferred to a later time.")
+    for name in QUEUES:
+        count = ScheduledJobRegistry(name, connection=connection).count
+        lines.append(f'starfit_queue_scheduled_jobs{{queue="{name}"}} {count:d}')
+    family("queue_started_jobs", "gauge", "Jobs being run.")
+    for name in QUEUES:
+        count = StartedJobRegistry(name, connection=connection).count
+        lines.append(f'starfit_queue_started_jobs{{queue="{name}"}} {count:d}')
+
+    for name, text in (
+        ("wait_seconds", "Time jobs waited in the queue."),
+        ("stage_seconds", "Time spent in each stage of a job."),
+    ):
+        family(name, "histogram", text)
+        for key in sorted(connection.scan_iter(f"{PREFIX}{name}:*")):
+            labels = key.decode().split(":")[-1]
+            values = {k.decode(): float(v) for k, v in connection.hgetall(key).items()}
+            for bound in BUCKETS + ("+Inf",):
+                le = f"{labels},le={bound}" if labels else f"le={bound}"
+                count = values.get(str(bound), 0)
+                lines.append(f"starfit_{name}_bucket{label_string(le)} {count:g}")
+            lines.append(f"starfit_{name}_sum{label_string(labels)} {values['sum']:g}")
+            lines.append(
+                f"starfit_{name}_count{label_string(labels)} {values['+Inf']:g}"
+            )
+
+    for name, text in (
+        ("jobs_total", "Jobs run, by result."),
+        ("size_total", "Models searched and bytes of results written."),
+    ):
+        family(name, "counter", text)
+        for labels, value in sorted(connection.hgetall(PREFIX + name).items()):
+            lines.append(f"starfit_{name}{label_string(labels.decode())} {int(value)}")
+
+    workers = Worker.all(connection=connection)
+    time_now = now()
+    family("worker_busy", "gauge", "Whether a worker is running a job.")
+    for w in workers:
+        busy = int(w.get_state() == "busy")
+        lines.append(f'starfit_worker_busy{{worker="{w.name}"}} {busy:d}')
+    family("worker_working_seconds_total", "counter", "Time workers spent on jobs.")
+    for w in workers:
+        lines.append(
+            f'starfit_worker_working_seconds_total{{worker="{w.name}"}} '
+            f"{w.total_working_time:g}"
+        )
+    family("worker_utilization", "gauge", "Fraction of its lifetime a worker worked.")
+    for w in workers:
+        age = (time_now - w.birth_date).total_seconds() if w.birth_date else 0
+        utilization = w.total_working_time / age if age > 0 else 0
+        lines.append(
+            f'starfit_worker_utilization{{worker="{w.name}"}} {utilization:.4f}'
+        )
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,144 @@
+import os
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from multiprocessing import get_context
+from os import getenv
+
+import matplotlib as mpl
+import matplotlib.pyplot as plt
+
+mpl.use("Agg")
+
+# Plot formats rendered with an external LaTeX; the others use matplotlib's
+# mathtext, which needs no subprocesses
+USETEX_FORMATS = [f for f in getenv("STARFIT_USETEX_FORMATS", "pdf").split(",") if f]
+
+# Maximum number of figures rendered at the same time
+PLOT_PROCESSES = int(getenv("STARFIT_PLOT_PROCESSES", 3))
+
+# Same fallback as StarFit uses when LaTeX is not installed
+MATHTEXT_RC = {
+    "text.usetex": False,
+    "font.family": "serif",
+    "font.serif": ["DejaVu Serif", "Computer Modern Roman"],
+    "mathtext.fontset": "cm",
+}
+USETEX_RC = {
+    "text.usetex": True,
+}
+
+# Text typeset by `warm_up`: the fonts and sizes of StarFit's labels, in
+# text and math mode
+WARM_UP_TEXT = [
+    "Element charge",
+    r"$\log\,\epsilon(X) - \log\,\epsilon(\mathrm{Fe})$",
+    r"$M = 25\,\mathrm{M}_\odot$, $E = 1.2\times10^{51}\,\mathrm{erg}$",
+]
+
+# Result being plotted.  Set before the plotting processes are forked so
+# that they inherit it instead of having it pickled.
+_result = None
+
+
+def abundance_plot(config):
+    imgfile = BytesIO()
+    labels, plotdata = _result.plot(
+        save=imgfile,
+        save_format=config.plotformat,
+        return_plot_data=True,
+        yscale=config.yscale,
+        ynorm="Fe",
+        multi=config.multi,
+    )
+    return imgfile.getvalue(), (labels, plotdata)
+
+
+def fitness_plot(config):
+    _result.plot_fitness(gen=True)
+    imgfile = BytesIO()
+    plt.savefig(imgfile, format=config.plotformat)
+    return imgfile.getvalue(), None
+
+
+def error_matrix_plot(config):
+    _result.plot_error_matrix(zoom=False)
+    imgfile = BytesIO()
+    plt.savefig(imgfile, format=config.plotformat)
+    return imgfile.getvalue(), None
+
+
+def render_plot(plot, config):
+    if config.plotformat in USETEX_FORMATS:
+        rc = USETEX_RC
+    else:
+        rc = MATHTEXT_RC
+    try:
+        with mpl.rc_context(rc):
+            return plot(config)
+    finally:
+        # Workers are long-lived, do not accumulate figures
+        plt.close("all")
+
+
+def warm_up():
+    """
+    Typeset sample labels in every LaTeX format.
+
+    LaTeX output of each fragment is kept on disk in the `tex.cache` of
+    MPLCONFIGDIR, keyed by a hash of its complete TeX source (the string,
+    the font size and the preamble built from the rc settings), and shared
+    by all workers.  What is left per process is the lookup of the TeX
+    fonts (kpsewhich), their maps and metrics.  Called in the worker before
+    any job, so the plotting processes forked for each job inherit them.
+    """
+    for plotformat in USETEX_FORMATS:
+        try:
+            with mpl.rc_context(USETEX_RC):
+                fig, ax = plt.subplots()
+                for i, text in enumerate(WARM_UP_TEXT):
+                    ax.text(0.1, 0.2 * (i + 1), text, fontsize=10 + 2 * i)
+                ax.set_xlabel(WARM_UP_TEXT[0])
+                fig.savefig(BytesIO(), format=plotformat)
+        except:
+            traceback.print_exc(file=sys.stderr)
+        finally:
+            plt.close("all")
+
+
+def make_plots(result, config):
+    global _result
+
+    plots = [abundance_plot]
+    if config.algorithm == "ga":
+        plots.append(fitness_plot)
+    if config.plot_cov:
+        plots.append(error_matrix_plot)
+
+    _result = result
+    try:
+        if len(plots) > 1 and PLOT_PROCESSES > 1:
+            with ProcessPoolExecutor(
+                max_workers=min(len(plots), PLOT_PROCESSES),
+                mp_context=get_context("fork"),
+            ) as executor:
+                futures = [executor.submit(render_plot, p, config) for p in plots]
+                rendered = [f.result() for f in futures]
+        else:
+            rendered = [render_plot(p, config) for p in plots]
+    finally:
+        _result = None
+
+    # Save plot data to ASCII file
+    labels, plotdata = rendered[0][1]
+    plotdatafile = os.path.join("/tmp", "plot_data_points" + config.start_time)
+    with open(plotdatafile, mode="w") as f:
+        for l in labels:
+            f.write(f"{l}\n")
+        f.write("\n")
+        f.write("Z      log(X/X_sun)\n")
+        for z, abu in zip(plotdata[0], plotdata[1]):
+            f.write(f"{z:<2}     {abu:7.5f}\n")
+
+    return [BytesIO(img) for img, _ in rendered]
@@ -0,0 +1,242 @@
+import json
+import sys
+import time
+import traceback
+from os import getenv
+
+import numpy as np
+from rq.exceptions import NoSuchJobError
+from rq.job import Job
+from starfit.autils.human import time2human
+
+# Running GA and multi searches publish a snapshot of their progress (the
+# generation or number of combinations searched, and the best solution so
+# far) at most every PROGRESS_INTERVAL seconds, which is also how often
+# they look for a request to stop or to cancel the job.  Snapshots are
+# dropped PROGRESS_TTL seconds after the last one.
+PROGRESS_INTERVAL = float(getenv("STARFIT_PROGRESS_INTERVAL", 2))
+PROGRESS_TTL = int(getenv("STARFIT_PROGRESS_TTL", 3600))
+
+# Every look at the status page of a job renews its lease for LEASE_TTL
+# seconds.  The search of a job whose results are not mailed is canceled
+# when its lease has lapsed and no identical submission waits for it: the
+# browser that was to collect the results is gone.
+LEASE_TTL = int(getenv("STARFIT_LEASE_TTL", 30))
+
+# Snapshots of the parts of a job (a hash with a field for each part),
+# requests to stop and to cancel, and leases, by the id of the job as
+# submitted
+PREFIX = "starfit:progress:"
+STOP_PREFIX = "starfit:stop:"
+CANCEL_PREFIX = "starfit:cancel:"
+LEASE_PREFIX = "starfit:lease:"
+
+# Why a search ended early (`solvers.Reporting.stopped`)
+ON_REQUEST = "on request"
+CANCELED = "canceled"
+
+
+class Progress(object):
+    """
+    Progress of the search of (a part of) a job.  `update` is called by
+    the search (see `solvers.Reporting`) and says why it is to stop, if
+    it is.
+
+    Searches in other processes, which only follow the requests to stop
+    or cancel, use `quiet()`.  With `leased`, the job is canceled when it
+    has been abandoned (see `abandoned`).
+    """
+
+    def __init__(
+        self,
+        connection,
+        job_id,
+        part=0,
+        total=None,
+        time_limit=None,
+        publish=True,
+        leased=False,
+    ):
+        self.connection = connection
+        self.job_id = job_id
+        self.part = part
+        self.total = total
+        self.time_limit = time_limit
+        self.publish = publish
+        self.leased = leased
+        # Counter of earlier runs of the search (GA epochs)
+        self.done = 0
+        self.start = time.time()
+        self.last = 0.0
+        self.reason = None
+
+    def quiet(self):
+        progress = Progress(self.connection, self.job_id, publish=False)
+        progress.last = time.time()
+        return progress
+
+    def update(self, search):
+        now = time.time()
+        if now - self.last < PROGRESS_INTERVAL:
+            return self.reason
+        self.last = now
+        try:
+            if self.publish:
+                self.connection.hset(
+                    PREFIX + self.job_id,
+                    str(self.part),
+                    json.dumps(self.snapshot(search, now)),
+                )
+                self.connection.expire(PREFIX + self.job_id, PROGRESS_TTL)
+            if self.leased and abandoned(self.connection, self.job_id):
+                # Also for the other processes and parts of the search
+                request_cancel(self.connection, self.job_id)
+            if canceled(self.connection, self.job_id):
+                self.reason = CANCELED
+            elif stopping(self.connection, self.job_id):
+                self.reason = ON_REQUEST
+        except:
+            traceback.print_exc(file=sys.stderr)
+        return self.reason
+
+    def snapshot(self, search, now):
+        elapsed = now - self.start
+        if hasattr(search, "top_fitness"):
+            # multi
+            counter = int(search.n_solved)
+            total = self.total or int(search.n_combinations)
+            fraction = counter / max(total, 1)
+            stars = search.top_stars
+            fitness = search.top_fitness
+        else:
+            counter = self.done + int(search.n_solved)
+            total = self.total
+            fraction = counter / total if total else 0.0
+            if self.time_limit:
+                fraction = max(fraction, elapsed / self.time_limit)
+            stars = search.s
+            fitness = search.f
+        eta = None
+        if fraction > 0:
+            eta = max(elapsed / min(fraction, 1.0) - elapsed, 0.0)
+        solution = list()
+        if np.isfinite(fitness[0]):
+            for index, offset in stars[0]:
+                db = search.db_idx[index]
+                solution.append(
+                    (
+                        search.db_lab[db] if search.db_n > 1 else "",
+                        int(index - search.db_off[db]),
+                        float(np.log10(offset)),
+                    )
+                )
+        return dict(
+            counter=counter,
+            total=total,
+            fraction=fraction,
+            elapsed=elapsed,
+            eta=eta,
+            fitness=float(fitness[0]),
+            solution=solution,
+            time=now,
+        )
+
+
+class Summary(object):
+    """Progress of all parts of a job, for the status page"""
+
+    def __init__(self, snapshots, n_parts):
+        best = min(snapshots, key=lambda s: s["fitness"])
+        self.counter = f"{sum(s['counter'] for s in snapshots):,d}"
+        total = sum(s["total"] or 0 for s in snapshots)
+        self.total = f"{total:,d}" if len(snapshots) == n_parts and total else None
+        self.percent = f"{100 * sum(s['fraction'] for s in snapshots) / n_parts:.1f}"
+        self.eta = None
+        if len(snapshots) == n_parts and None not in [s["eta"] for s in snapshots]:
+            self.eta = time2human(max(s["eta"] for s in snapshots))
+        self.fitness = None
+        if np.isfinite(best["fitness"]):
+            self.fitness = f"{best['fitness']:.3f}"
+        self.solution = best["solution"]
+        self.age = time2human(max(time.time() - best["time"], 0))
+
+
+def summary(connection, job_id, n_parts=1):
+    """Latest progress of the job `job_id`, or None if it has not reported"""
+    snapshots = [json.loads(s) for s in connection.hvals(PREFIX + job_id)]
+    if len(snapshots) == 0:
+        return None
+    return Summary(snapshots, max(n_parts, len(snapshots)))
+
+
+def request_stop(connection, job_id):
+    """Ask the search of `job_id` to stop and report its best solution so far"""
+    connection.set(STOP_PREFIX + job_id, 1, ex=PROGRESS_TTL)
+
+
+def stopping(connection, job_id):
+    return connection.exists(STOP_PREFIX + job_id) > 0
+
+
+def request_cancel(connection, job_id):
+    """
+    Nobody will collect the results of `job_id`: its search ends at its
+    next progress report and the job fails
+    """
+    connection.set(CANCEL_PREFIX + job_id, 1, ex=PROGRESS_TTL)
+
+
+def canceled(connection, job_id):
+    return connection.exists(CANCEL_PREFIX + job_id) > 0
+
+
+def renew(connection, job_id):
+    """Somebody is waiting for the results of `job_id`"""
+    connection.set(LEASE_PREFIX + job_id, 1, ex=LEASE_TTL)
+
+
+def abandoned(connection, job_id):
+    """
+    Nobody has looked at the status of `job_id` for LEASE_TTL seconds, and
+    no identical submission follows it (or the job continuing it).  Followers
+    whose results are not mailed and whose own lease has lapsed are dropped.
+    """
+    if connection.exists(LEASE_PREFIX + job_id) > 0:
+        return False
+    try:
+        job = Job.fetch(job_id, connection=connection)
+        while "continued_by" in job.meta:
+            job = Job.fetch(job.meta["continued_by"], connection=connection)
+    except NoSuchJobError:
+        return False
+    followers = Job.fetch_many(job.dependent_ids, connection=connection)
+    for follower_id, follower in zip(job.dependent_ids, followers):
+        if follower is not None and not gone(connection, follower):
+            return False
+        drop_follower(connection, job, follower_id, follower)
+    return True
+
+
+def gone(connection, follower):
+    """The submitter of `follower` will not collect its results"""
+    if follower.is_canceled:
+        return True
+    if "follows" not in follower.meta or follower.args[0].mail:
+        return False
+    return connection.exists(LEASE_PREFIX + follower.id) == 0
+
+
+def drop_follower(connection, job, follower_id, follower):
+    """Cancel `follower` and remove it from the dependents of `job`"""
+    if follower is not None and not follower.is_canceled:
+        follower.cancel(remove_from_dependencies=True)
+    connection.srem(job.dependents_key, follower_id)
+
+
+def clear(connection, job_id):
+    connection.delete(
+        PREFIX + job_id,
+        STOP_PREFIX + job_id,
+        CANCEL_PREFIX + job_id,
+        LEASE_PREFIX + job_id,
+    )
@@ -0,0 +1,183 @@
+import hashlib
+import json
+import os
+import shutil
+import sys
+import traceback
+from os import getenv
+from pathlib import Path
+from uuid import uuid4
+
+import islands
+from utils import starfit_version
+
+CACHE_DIR = Path(getenv("STARFIT_CACHE", "/var/cache/starfit")) / "results"
+
+# Total size of the cached results on disk
+CACHE_SIZE = int(getenv("STARFIT_CACHE_SIZE", 2**30))
+
+# Config fields that determine the outcome of a fit.  The email address is
+# deliberately not part of the key: it only changes how results are delivered.
+KEY_FIELDS = (
+    "algorithm",
+    "filename",
+    "database",
+    "z_min",
+    "z_max",
+    "combine",
+    "z_exclude",
+    "z_lolim",
+    "upper_lim",
+    "cdf",
+    "det",
+    "cov",
+    "dst",
+    "limit_solution",
+    "limit_solver",
+    "constraints",
+    "plotformat",
+    "yscale",
+    "multi",
+    "plot_cov",
+    "show_index",
+)
+KEY_FIELDS_MULTI = (
+    "fixed",
+    "sol_size",
+    "sol_sizes",
+    "group",
+)
+KEY_FIELDS_GA = (
+    "fixed",
+    "sol_size",
+    "group",
+    "pin",
+    "gen",
+    "pop_size",
+    "time_limit",
+    "spread",
+    "tour_size",
+    "frac_mating_pool",
+    "frac_elite",
+    "mut_rate_index",
+    "mut_rate_offset",
+    "mut_offset_magnitude",
+    "local_search",
+    "seed",
+)
+
+
+def job_key(config):
+    """
+    Canonical hash of the inputs of a job, or None if the result is not
+    reproducible or is not cached (batches).  A GA run is only reproducible
+    with a user-supplied seed, from scratch (no warm start), for a fixed
+    number of generations (no time limit, which makes it depend on the
+    speed of the worker) and in one population (islands migrate at times
+    that depend on the worker too).
+    """
+    if config.algorithm == "ga":
+        if config.seed is None or config.warm_start:
+            return None
+        if config.time_limit > 0 or islands.GA_ISLANDS > 1:
+            return None
+    if config.batch is not None:
+        return None
+
+    fields = KEY_FIELDS
+    if config.algorithm == "multi":
+        fields = fields + KEY_FIELDS_MULTI
+    elif config.algorithm == "ga":
+        fields = fields + KEY_FIELDS_GA
+
+    key = {k: getattr(config, k) for k in fields}
+    key["starfit_version"] = starfit_version
+    key["star"] = config.star_hash
+    key["dbstat"] = list()
+    for path in config.dbpath:
+        stat = Path(path).stat()
+        key["dbstat"].append([stat.st_size, stat.st_mtime_ns])
+
+    text = json.dumps(key, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def get(key):
+    """Return the cached fragment, plots and paths of data files, or None"""
+    entry = CACHE_DIR / key
+    try:
+        with open(entry / "meta.json", "r") as f:
+            meta = json.load(f)
+        fragment = (entry / "fragment.html").read_text()
+        plots = [(entry / name).read_bytes() for name in meta["plots"]]
+        files = [(name, str(entry / "files" / name)) for name in meta["files"]]
+    except FileNotFoundError:
+        return None
+    except:
+        traceback.print_exc(file=sys.stderr)
+        return None
+
+    # Mark as recently used
+    try:
+        os.utime(entry)
+    except OSError:
+        pass
+
+    return dict(fragment=fragment, plots=plots, files=files)
+
+
+def put(key, fragment, plots, files, plotformat):
+    """
+    Store a result.  `plots` is a list of image bytes, `files` a list of
+    (attachment name, path).
+    """
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    entry = CACHE_DIR / key
+    if entry.exists():
+        return
+
+    # Build the entry under a temporary name so readers never see a partial one
+    tmp = CACHE_DIR / f".tmp-{uuid4()}"
+    try:
+        (tmp / "files").mkdir(parents=True)
+        meta = dict(plots=list(), files=list())
+        for i, plot in enumerate(plots):
+            name = f"plot{i:d}.{plotformat}"
+            (tmp / name).write_bytes(plot)
+            meta["plots"].append(name)
+        for name, path in files:
+            shutil.copyfile(path, tmp / "files" / name)
+            meta["files"].append(name)
+        (tmp / "fragment.html").write_text(fragment)
+        with open(tmp / "meta.json", "w") as f:
+            json.dump(meta, f)
+        # Group-writable so the web server can mark the entry as used
+        os.chmod(tmp, 0o775)
+        os.rename(tmp, entry)
+    except OSError:
+        traceback.print_exc(file=sys.stderr)
+        shutil.rmtree(tmp, ignore_errors=True)
+        return
+
+    evict()
+
+
+def evict(max_bytes=CACHE_SIZE):
+    """Remove least recently used entries until the cache fits its budget"""
+    entries = list()
+    total = 0
+    for entry in CACHE_DIR.iterdir():
+        if entry.name.startswith("."):
+            continue
+        try:
+            size = sum(f.stat().st_size for f in entry.rglob("*") if f.is_file())
+            entries.append((entry.stat().st_mtime, size, entry))
+        except OSError:
+            continue
+        total += size
+
+    for _, size, entry in sorted(entries):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
@@ -0,0 +1,76 @@
+from math import comb, prod
+from os import getenv
+from pathlib import Path
+
+from starfit.autils.stardb import StarDB
+
+# Job classes, cheapest first.  Each has its own queue and worker slice.
+QUEUES = ("interactive", "standard", "batch")
+
+# Estimated run times (seconds) up to which a job is interactive, and from
+# which it is a batch job
+INTERACTIVE_MAX = float(getenv("STARFIT_INTERACTIVE_MAX", 5))
+BATCH_MIN = float(getenv("STARFIT_BATCH_MIN", 120))
+
+# Throughput of one worker: models fitted per second by `single`, and stars
+# matched per second by `multi` (a combination of n stars counts n times)
+SINGLE_RATE = float(getenv("STARFIT_SINGLE_RATE", 10000))
+MULTI_RATE = float(getenv("STARFIT_MULTI_RATE", 10000))
+
+
+class StarDBHeader(StarDB):
+    """Read only the header of a database, up to the number of models"""
+
+    def _load(self):
+        self.version = int(self._read_uin())
+        self.name = str(self._read_str())
+        if self.version < 10200:
+            self.label = ""
+        else:
+            self.label = str(self._read_str())
+        self.ncomment = int(self._read_uin())
+        self.comments = self._read_str(self.ncomment)
+        self.nstar = int(self._read_uin())
+
+
+# Number of models per database, keyed by path and mtime
+_models = dict()
+
+
+def db_models(path):
+    path = Path(path).resolve()
+    key = (path, path.stat().st_mtime_ns)
+    if key not in _models:
+        _models[key] = StarDBHeader(path, silent=True).nstar
+    return _models[key]
+
+
+def n_combinations(config):
+    """Size of the combination space of a `multi` search"""
+    models = [db_models(path) for path in config.dbpath]
+    return prod(
+        comb(sum(models[i] for i in group), size)
+        for group, size in zip(config.group, config.sol_sizes)
+    )
+
+
+def estimate_cost(config):
+    """Estimated run time of a job in seconds, excluding plots and mail"""
+    n_stars = len(config.batch or [config])
+    if config.algorithm == "single":
+        cost = sum(db_models(path) for path in config.dbpath) / SINGLE_RATE
+    elif config.algorithm == "multi":
+        cost = n_combinations(config) * config.sol_size / MULTI_RATE
+        # The search stops at its time limit
+        cost = min(cost, float(config.time_limit))
+    else:
+        cost = float(config.time_limit)
+    return cost * n_stars
+
+
+def choose_queue(cost):
+    if cost <= INTERACTIVE_MAX:
+        return "interactive"
+    if cost < BATCH_MIN:
+        return "standard"
+    return "batch"
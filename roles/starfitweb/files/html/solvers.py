@@ -0,0 +1,311 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from types import FunctionType
+
+import matplotlib.pyplot as plt
+import numpy as np
+import stars
+from starfit import Ga, Multi, Single
+from starfit.fit import get_fitness, get_solution
+from starfit.starfit import StarFit
+from starfit.utils import set_priority
+
+
+def packed_setup():
+    """
+    StarFit's `_setup`, reading its star with `stars.load`, which also
+    takes a packed star.  Only the copy sees the other `Star`; starfit's
+    module is left as it is.
+    """
+    setup = StarFit._setup
+    namespace = dict(setup.__globals__, Star=stars.load)
+    function = FunctionType(setup.__code__, namespace, setup.__name__)
+    function.__kwdefaults__ = setup.__kwdefaults__
+    function.__doc__ = setup.__doc__
+    return function
+
+
+class PackedSetup(object):
+    """Mixin for solvers that take a packed star (`config.star`) as `filename`"""
+
+    _setup = packed_setup()
+
+
+class PackedSingle(PackedSetup, Single):
+    pass
+
+
+class PackedMulti(PackedSetup, Multi):
+    pass
+
+
+class PackedGa(PackedSetup, Ga):
+    pass
+
+
+class StopSearch(Exception):
+    """The search was stopped and keeps its best solutions so far"""
+
+
+class Reporting(object):
+    """
+    Mixin for GA and multi searches that report their progress to
+    `progress` (a `progress.Progress`) whenever they update `frac_done`,
+    and that end early, keeping the best solutions found so far, when it
+    asks them to (also when the job is canceled) or at `deadline` (seconds
+    since the epoch).  `stopped` tells why they did, if they did.
+    """
+
+    progress = None
+    deadline = None
+    stopped = False
+
+    @property
+    def frac_done(self):
+        return self.__dict__.get("_frac_done", 0.0)
+
+    @frac_done.setter
+    def frac_done(self, value):
+        self._frac_done = value
+        if self.deadline is not None and time.time() >= self.deadline:
+            raise StopSearch("time limit reached")
+        if self.progress is not None:
+            reason = self.progress.update(self)
+            if reason is not None:
+                raise StopSearch(reason)
+
+
+class ReportingMulti(Reporting, PackedMulti):
+    """
+    Multi search that reports its progress and can be stopped.  The models
+    of each group are searched best first (see `order_models`), so that a
+    search that is stopped early has covered the most promising
+    combinations.
+    """
+
+    executor = None
+
+    def __init__(self, *args, progress=None, deadline=None, **kwargs):
+        self.progress = progress
+        self.deadline = deadline
+        try:
+            super().__init__(*args, **kwargs)
+        except StopSearch as stop:
+            self.stop_search(
+                str(stop), kwargs.get("save", False), kwargs.get("webfile")
+            )
+        finally:
+            # The pool would otherwise live on through the report of the job
+            if self.executor is not None:
+                self.executor.shutdown(cancel_futures=True)
+
+    def order_models(self):
+        """
+        Sort the models of each group by their own fitness to the star.
+        Combinations are enumerated with the models of the first group in
+        the outer loop, each taking all combinations of the models before
+        it, so the best models are combined first.
+        """
+        sol = np.recarray(
+            (self.db_size, 1), dtype=[("index", np.int64), ("offset", np.float64)]
+        )
+        sol.index[:, 0] = np.arange(self.db_size)
+        if self.fixed_offsets:
+            sol.offset[:, 0] = self.ejecta
+        else:
+            sol.offset = 1.0e-4
+        fitness = get_fitness(
+            trimmed_db=self.trimmed_db,
+            eval_data=self.eval_data,
+            z_exclude_index=self.exclude_index,
+            sol=sol,
+            ejecta=self.ejecta,
+            fixed_offsets=self.fixed_offsets,
+            cdf=self.cdf,
+            dst=self.dst,
+            limit_solver=self.limit_solver,
+            limit_solution=self.limit_solution,
+            local_search=False,
+        )
+        for start, n in zip(self.group_off, self.group_num):
+            end = start + n
+            models = self.group_index[start:end]
+            models[:] = models[np.argsort(fitness[models], kind="stable")]
+
+    def init_futures(self, threads=None, nice=19):
+        self.order_models()
+        return self.submit_blocks(0, self.n_combinations, threads=threads, nice=nice)
+
+    def submit_blocks(self, gen_start, gen_end, threads=None, nice=19):
+        """
+        Search the combinations from `gen_start` to `gen_end` in blocks of
+        `block_size`, in a pool of `threads` processes (`executor`)
+        """
+        if threads is None:
+            threads = multiprocessing.cpu_count()
+        self.executor = ProcessPoolExecutor(
+            max_workers=threads,
+            initializer=set_priority,
+            initargs=(nice,),
+        )
+        slice_range = np.arange(gen_start, gen_end, self.block_size, dtype=int)
+        slice_range = np.append(slice_range, gen_end)
+
+        futures = list()
+        for i in range(len(slice_range) - 1):
+            futures.append(
+                self.executor.submit(
+                    get_solution,
+                    gen_start=slice_range[i],
+                    gen_end=slice_range[i + 1],
+                    fixed_offsets=self.fixed_offsets,
+                    eval_data=self.eval_data,
+                    exclude_index=self.exclude_index,
+                    trimmed_db=self.trimmed_db,
+                    ejecta=self.ejecta,
+                    sol_size=self.sol_size,
+                    cdf=self.cdf,
+                    dst=self.dst,
+                    limit_solution=self.limit_solution,
+                    limit_solver=self.limit_solver,
+                    num=self.group_num,
+                    size=self.sol_sizes,
+                    com=self.group_comb,
+                    index=self.group_index,
+                    return_size=self.n_top,
+                )
+            )
+        self.futures = futures
+        return futures
+
+    def stop_search(self, reason, save=False, webfile=None):
+        # Blocks that have started would keep the worker's cores busy after
+        # the search has been reported.  The pool has no public way to end
+        # its processes.
+        if self.executor is not None:
+            for process in list((self.executor._processes or dict()).values()):
+                process.terminate()
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        self.stopped = reason
+        self.sorted_stars = self.top_stars[: self.n_top]
+        self.sorted_fitness = self.top_fitness[: self.n_top]
+        # The results file the search writes when it completes
+        if save and webfile:
+            self.save_file(Path("/tmp") / webfile)
+        self.close_logger(timing="Stopped after")
+
+
+class PlannedMulti(PackedMulti):
+    """
+    Set up a multi search without running it, to find the size of the
+    combination space (`n_combinations`).
+    """
+
+    def init_futures(self, threads=None, nice=19):
+        return []
+
+
+class ShardedMulti(ReportingMulti):
+    """
+    Search one of `n_shards` contiguous ranges of the combination space
+    (`shard_size` combinations).  `top_stars` and `top_fitness` hold the
+    best solutions of the shard.
+    """
+
+    def __init__(self, *args, shard=0, n_shards=1, **kwargs):
+        self.shard = shard
+        self.n_shards = n_shards
+        super().__init__(*args, **kwargs)
+
+    def init_futures(self, threads=None, nice=19):
+        self.order_models()
+        shard_range = np.linspace(0, self.n_combinations, self.n_shards + 1, dtype=int)
+        gen_start = shard_range[self.shard]
+        gen_end = shard_range[self.shard + 1]
+        self.shard_size = int(gen_end - gen_start)
+        return self.submit_blocks(gen_start, gen_end, threads=threads, nice=nice)
+
+
+class MergedMulti(PackedMulti):
+    """
+    Multi result assembled from the top lists of the shards of a search,
+    in place of running the search.
+    """
+
+    def __init__(self, *args, top_stars, top_fitness, **kwargs):
+        self.shard_stars = top_stars
+        self.shard_fitness = top_fitness
+        super().__init__(*args, **kwargs)
+
+    def working_arrays(self):
+        super().working_arrays()
+        stars = np.concatenate(self.shard_stars)
+        fitness = np.concatenate(self.shard_fitness)
+        sort = np.argsort(fitness)[: len(self.top_fitness)]
+        self.top_stars[: len(sort)] = stars[sort]
+        self.top_fitness[: len(sort)] = fitness[sort]
+
+    def init_futures(self, threads=None, nice=19):
+        return []
+
+
+class SeededGa(Reporting, PackedGa):
+    """
+    Ga whose initial population starts with the solutions in `population`
+    (e.g. the population of a previous run plus migrants from other runs).
+    `islands` holds the fitness histories of other populations evolved
+    alongside this one, which are added to the fitness plot.  It reports
+    its progress to `progress` and can be stopped (see `Reporting`).
+    """
+
+    def __init__(self, *args, population=None, islands=(), progress=None, **kwargs):
+        self.population = population
+        self.islands = islands
+        self.progress = progress
+        try:
+            super().__init__(*args, **kwargs)
+        except StopSearch as stop:
+            self.stop_search(str(stop))
+
+    def stop_search(self, reason):
+        # The population is sorted after each generation
+        self.stopped = reason
+        self.gen = self.n_solved
+        self.elapsed = self.times[-1]
+        self.sorted_stars = self.s
+        self.sorted_fitness = self.f
+        self.close_logger(timing="Stopped after")
+
+    def _populate(self):
+        s = super()._populate()
+        if self.population is not None and self.population.shape[1:] == s.shape[1:]:
+            n = min(len(self.population), len(s))
+            s[:n] = self.population[:n]
+        return s
+
+    def plot_fitness(self, gen=False, **kwargs):
+        super().plot_fitness(gen=gen, **kwargs)
+        ax = plt.gca()
+        for history, times in self.islands:
+            if gen:
+                x = np.arange(len(history["best"]))
+            else:
+                x = times
+            ax.plot(x, history["best"], color="tab:green", alpha=0.3, lw=0.8)
+
+
+class PreparedSingle(PackedSingle):
+    """
+    Single search that is set up but not run; `stacked.fit_stack` evaluates
+    the searches of several stars together.
+    """
+
+    def __init__(self, *args, **kwargs):
+        StarFit.__init__(self, *args, **kwargs)
+        self.unsorted_stars = np.recarray(
+            (self.db_size, 1), dtype=[("index", np.int64), ("offset", np.float64)]
+        )
+        self.unsorted_stars.offset = 1.0e-4
+        self.unsorted_stars.index[:, 0] = np.arange(self.db_size)
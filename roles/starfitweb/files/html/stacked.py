@@ -0,0 +1,136 @@
+from os import getenv
+
+import numpy as np
+from starfit.fit import get_fitness
+
+# Number of stars of a batch whose single searches are set up and evaluated
+# together, and number of models evaluated at a time.  Each set-up search
+# holds a copy of the databases, so the first bounds the memory of a batch.
+STACK_SIZE = int(getenv("STARFIT_STACK_SIZE", 16))
+STACK_CHUNK = int(getenv("STARFIT_STACK_CHUNK", 8192))
+
+# Number of best models kept for each star
+N_TOP = 1000
+
+
+def stackable(search):
+    """
+    Whether the fitness of a single search has the closed form used by
+    `fit_stack`: only two-sided data points (no upper or lower limits),
+    without detection thresholds or error covariances, and no combined
+    elements.
+    """
+    eval_data = search.eval_data[~search.exclude_index]
+    if len(search.combine[0]) > 0 or len(eval_data) < 2:
+        return False
+    if eval_data.covariance.shape[1] > 0 or np.any(eval_data.error <= 0):
+        return False
+    if search.det and np.any(eval_data.detection > -80.0):
+        return False
+    return True
+
+
+def stack_arrays(searches):
+    """
+    Weights and observed abundances of the stars of `searches` (stars x
+    elements), and for each element the search and row of a trimmed
+    database that holds it (the rows are the same in every search)
+    """
+    columns = dict()
+    rows = list()
+    for i, search in enumerate(searches):
+        for j, element in enumerate(search.eval_data.element):
+            if not search.exclude_index[j] and element.Z not in columns:
+                columns[element.Z] = len(rows)
+                rows.append((i, j))
+    weight = np.zeros((len(searches), len(rows)))
+    observed = np.zeros((len(searches), len(rows)))
+    for i, search in enumerate(searches):
+        for j, data in enumerate(search.eval_data):
+            if not search.exclude_index[j]:
+                k = columns[data.element.Z]
+                weight[i, k] = data.error**-2
+                observed[i, k] = data.abundance
+    return weight, observed, rows
+
+
+def fit_stack(searches, chunk=None):
+    """
+    Evaluate the single searches of several stars, set up with the same
+    databases (`solvers.PreparedSingle`), in one pass over the models.
+
+    For data points with symmetric errors only, the best dilution of a
+    model is the weighted mean difference between the star and the model,
+    so the fitness of all stars against a chunk of models follows from
+    three matrix products.  The other searches are evaluated one by one
+    with StarFit's solver, like `Single`.
+    """
+    if chunk is None:
+        chunk = STACK_CHUNK
+    fast = list()
+    for search in searches:
+        if stackable(search):
+            fast.append(search)
+        else:
+            search.unsorted_fitness = solve(search)
+
+    if len(fast) > 0:
+        weight, observed, rows = stack_arrays(fast)
+        # Dilution factors are limited to 1 unless both limits are off
+        limited = np.array(
+            [s.limit_solver is not False or s.limit_solution is not False for s in fast]
+        )
+        n_data = np.array([np.count_nonzero(~s.exclude_index) for s in fast])
+        sw = weight.sum(axis=1)[:, np.newaxis]
+        swo = (weight * observed).sum(axis=1)[:, np.newaxis]
+        swoo = (weight * observed**2).sum(axis=1)[:, np.newaxis]
+
+        n_models = fast[0].db_size
+        fitness = np.ndarray((len(fast), n_models))
+        log_offset = np.ndarray((len(fast), n_models))
+        for start in range(0, n_models, chunk):
+            end = min(start + chunk, n_models)
+            abu = np.log10(
+                np.array([fast[i].trimmed_db[j, start:end] for i, j in rows])
+            )
+            p = weight @ abu
+            q = (weight * observed) @ abu
+            r = weight @ abu**2
+            c = (swo - p) / sw
+            c[limited] = np.minimum(c[limited], 0.0)
+            fitness[:, start:end] = swoo - 2 * q + r - 2 * c * (swo - p) + c**2 * sw
+            log_offset[:, start:end] = c
+        fitness /= (n_data - 1)[:, np.newaxis]
+
+        for i, search in enumerate(fast):
+            search.unsorted_fitness = fitness[i]
+            search.unsorted_stars.offset[:, 0] = 10 ** log_offset[i]
+
+    for search in searches:
+        rank(search)
+
+
+def solve(search):
+    return get_fitness(
+        trimmed_db=search.trimmed_db,
+        eval_data=search.eval_data,
+        z_exclude_index=search.exclude_index,
+        sol=search.unsorted_stars,
+        cdf=search.cdf,
+        dst=search.dst,
+        limit_solver=search.limit_solver,
+        limit_solution=search.limit_solution,
+        local_search=False,
+    )
+
+
+def rank(search, n_top=N_TOP):
+    """Sort the best `n_top` models of a search"""
+    fitness = search.unsorted_fitness
+    n_top = min(n_top, len(fitness))
+    top = np.argpartition(fitness, n_top - 1)[:n_top]
+    sort_index = top[np.argsort(fitness[top])]
+    search.sorted_fitness = fitness[sort_index]
+    search.sorted_stars = search.unsorted_stars[sort_index]
+    search.rank = sort_index
+    search.close_logger(timing="Finished in")
@@ -0,0 +1,73 @@
+import tempfile
+from functools import lru_cache
+from pathlib import Path
+
+from starfit import BBN, REF, Star
+from starfit.autils.abusets import BBNAbu, SolAbu
+from starfit.utils import find_data
+
+# Attributes of a parsed star that travel with the job.  The reference
+# abundances (BBN and solar) are the same for every star, so the worker
+# loads them once instead of receiving them with each job.
+FIELDS = (
+    "version",
+    "name",
+    "source",
+    "comment",
+    "data_format",
+    "input_data_format",
+    "data_mode",
+    "norm_element",
+    "n_elements",
+    "data_type",
+    "element_abundances",
+    "added_elements",
+    "solar_ref",
+    "filename",
+)
+
+
+def parse(data, filename):
+    """Parse and validate the contents of a star file"""
+    with tempfile.NamedTemporaryFile(suffix=".dat") as f:
+        f.write(data)
+        f.flush()
+        star = Star(f.name, silent=True)
+    star.filename = Path(filename)
+    return star
+
+
+def pack(star):
+    """Compact form of a parsed star, to be stored with the job"""
+    return {key: getattr(star, key) for key in FIELDS}
+
+
+@lru_cache(maxsize=None)
+def bbn_data():
+    return BBNAbu(name=find_data(REF, BBN), silent=True)
+
+
+@lru_cache(maxsize=None)
+def solar_data(solar_ref):
+    return SolAbu(name=solar_ref, silent=True)
+
+
+def unpack(packed):
+    """Star from its packed form, without reading or parsing its file"""
+    star = Star.__new__(Star)
+    star.silent = True
+    star.setup_logger(silent=True)
+    star.__dict__.update(packed)
+    star.BBN_data = bbn_data()
+    star.sun = solar_data(packed["solar_ref"])
+    return star
+
+
+def load(filename, silent=False):
+    """
+    Star from a packed star (`config.star`) or a file name; the solvers
+    read their star with this (see `solvers.PackedSetup`)
+    """
+    if isinstance(filename, dict):
+        return unpack(filename)
+    return Star(filename, silent=silent)
@@ -0,0 +1,181 @@
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+import traceback
+from os import getenv
+from pathlib import Path
+
+import metrics
+from redis import Redis
+from rq import Queue, Worker
+
+# The worker instances (rq-worker@NN) and the queues each listens to are
+# configured by the rq role in /etc/starfit/rq-worker-NN.env.  Instances
+# with the same queues form a slice.  The supervisor runs at least
+# SLICE_MIN workers of each slice, and at most STARFIT_WORKERS_MAX (default:
+# all instances), as many CPUs allow (WORKER_CPUS per worker) and as fit
+# in the available memory.
+WORKER_CONFIG = Path(getenv("STARFIT_WORKER_CONFIG", "/etc/starfit"))
+WORKERS_MAX = int(getenv("STARFIT_WORKERS_MAX", 0))
+SLICE_MIN = int(getenv("STARFIT_SLICE_MIN", 1))
+WORKER_CPUS = float(getenv("STARFIT_WORKER_CPUS", 1))
+
+# Memory ceiling of a worker (MemoryMax of its unit), memory of a worker
+# without databases, and memory left to the rest of the system.  A worker
+# is expected to need its base memory plus twice the largest databases of
+# recent jobs (parsed and trimmed copies), up to its ceiling.
+WORKER_MEMORY = int(getenv("STARFIT_WORKER_MEMORY", 4 * 2**30))
+WORKER_BASE_MEMORY = int(getenv("STARFIT_WORKER_BASE_MEMORY", 2**29))
+MEMORY_RESERVE = int(getenv("STARFIT_MEMORY_RESERVE", 2**30))
+
+# Seconds between two looks at the queues, and how long a worker has to be
+# idle before it is stopped (unless memory runs short)
+SUPERVISOR_INTERVAL = float(getenv("STARFIT_SUPERVISOR_INTERVAL", 10))
+SCALE_DOWN_IDLE = float(getenv("STARFIT_SCALE_DOWN_IDLE", 300))
+
+# Number of recent jobs whose database sizes are used for the estimate
+MEMORY_HISTORY = 100
+
+
+def unit(instance):
+    return f"rq-worker@{instance}.service"
+
+
+def slices():
+    """Worker instances by the queues they listen to, cheapest first"""
+    groups = dict()
+    for path in sorted(WORKER_CONFIG.glob("rq-worker-*.env")):
+        instance = re.fullmatch(r"rq-worker-(\w+)\.env", path.name).group(1)
+        queues = ""
+        for line in path.read_text().splitlines():
+            if line.startswith("STARFIT_QUEUES="):
+                queues = line.split("=", 1)[1].strip()
+        groups.setdefault(tuple(queues.split()), list()).append(instance)
+    return groups
+
+
+def active(instances):
+    """The instances whose units are running (or starting)"""
+    states = subprocess.run(
+        ["systemctl", "is-active"] + [unit(i) for i in instances],
+        capture_output=True,
+        text=True,
+    ).stdout.split()
+    return {
+        i for i, state in zip(instances, states) if state in ("active", "activating")
+    }
+
+
+def memory_available():
+    with open("/proc/meminfo") as f:
+        for line in f:
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def memory_estimate(connection):
+    """Memory a worker is expected to need, from the jobs run lately"""
+    records = connection.lrange(metrics.PREFIX + "jobs", 0, MEMORY_HISTORY - 1)
+    sizes = [json.loads(r)["sizes"].get("db_bytes", 0) for r in records]
+    if len(sizes) == 0:
+        return WORKER_MEMORY
+    return min(WORKER_BASE_MEMORY + 2 * max(sizes), WORKER_MEMORY)
+
+
+def plan(groups, busy, queued, limit):
+    """
+    Number of workers to run in each slice: its busy workers plus one for
+    each job waiting in the first of its queues, between SLICE_MIN and the
+    size of the slice.  Over `limit` in all, workers that are not busy are
+    taken from the most expensive slices first.
+    """
+    want = dict()
+    for queues, instances in groups.items():
+        n = len(busy.intersection(instances))
+        if len(queues) > 0:
+            n += queued.get(queues[0], 0)
+        want[queues] = min(max(n, SLICE_MIN), len(instances))
+    excess = sum(want.values()) - limit
+    for queues in reversed(list(groups)):
+        if excess <= 0:
+            break
+        floor = max(SLICE_MIN, len(busy.intersection(groups[queues])))
+        cut = min(excess, want[queues] - floor)
+        if cut > 0:
+            want[queues] -= cut
+            excess -= cut
+    return want
+
+
+class Supervisor(object):
+    """Start and stop worker instances to follow the demand"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        # Time since which each running worker has been idle
+        self.idle_since = dict()
+
+    def step(self):
+        groups = slices()
+        instances = [i for members in groups.values() for i in members]
+        running = active(instances)
+
+        # Workers name themselves StarFit-NN
+        states = dict()
+        for worker in Worker.all(connection=self.connection):
+            if worker.name.startswith("StarFit-"):
+                states[worker.name.split("-", 1)[1]] = worker.get_state()
+        busy = {i for i in running if states.get(i) == "busy"}
+        now = time.time()
+        for i in instances:
+            if i in running and states.get(i) == "idle":
+                self.idle_since.setdefault(i, now)
+            else:
+                self.idle_since.pop(i, None)
+
+        names = {q for queues in groups for q in queues}
+        queued = {q: Queue(q, connection=self.connection).count for q in names}
+
+        n_cpus = max(1, int((os.cpu_count() or 1) / WORKER_CPUS))
+        n_memory = len(running) + int(
+            (memory_available() - MEMORY_RESERVE) // memory_estimate(self.connection)
+        )
+        limit = min(WORKERS_MAX or len(instances), n_cpus, n_memory)
+        # Short of memory, idle workers are stopped straight away
+        pressure = n_memory < len(running)
+
+        want = plan(groups, busy, queued, limit)
+        for queues, members in groups.items():
+            on = [i for i in members if i in running]
+            off = [i for i in members if i not in running]
+            for i in off[: max(want[queues] - len(on), 0)]:
+                self.systemctl("start", i)
+            n_stop = len(on) - want[queues]
+            for i in reversed(on):
+                if n_stop <= 0:
+                    break
+                idle = now - self.idle_since.get(i, now)
+                if i in self.idle_since and (pressure or idle >= SCALE_DOWN_IDLE):
+                    self.systemctl("stop", i)
+                    self.idle_since.pop(i)
+                    n_stop -= 1
+
+    def systemctl(self, command, instance):
+        print(f"{command} {unit(instance)}", file=sys.stderr)
+        subprocess.run(["systemctl", command, "--no-block", unit(instance)])
+
+    def run(self):
+        while True:
+            try:
+                self.step()
+            except:
+                traceback.print_exc(file=sys.stderr)
+            time.sleep(SUPERVISOR_INTERVAL)
+
+
+if __name__ == "__main__":
+    Supervisor(Redis()).run()
@@ -0,0 +1,81 @@
+import hashlib
+from os import getenv
+
+# Star files of queued jobs are kept in Redis, once per distinct content,
+# under the SHA-256 of the file.  A file is held for at most
+# UPLOAD_MAX_AGE seconds after it was last submitted, and for UPLOAD_TTL
+# seconds after the last job using it has ended, so that a resubmission
+# with other parameters finds it again.
+UPLOAD_MAX_AGE = int(getenv("STARFIT_UPLOAD_MAX_AGE", 7 * 86400))
+UPLOAD_TTL = int(getenv("STARFIT_UPLOAD_TTL", 86400))
+
+PREFIX = "starfit:upload:"
+
+# Store the file if it is new and count one more job using it
+PUT = """
+redis.call("HSETNX", KEYS[1], "data", ARGV[1])
+local refs = redis.call("HINCRBY", KEYS[1], "refs", 1)
+redis.call("EXPIRE", KEYS[1], ARGV[2])
+return refs
+"""
+
+# Count one job less, and let the file expire once no job uses it
+RELEASE = """
+if redis.call("EXISTS", KEYS[1]) == 0 then
+    return -1
+end
+local refs = redis.call("HINCRBY", KEYS[1], "refs", -1)
+if refs <= 0 then
+    redis.call("HSET", KEYS[1], "refs", 0)
+    redis.call("EXPIRE", KEYS[1], ARGV[1])
+end
+return refs
+"""
+
+
+def digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def put(connection, data):
+    """Store a star file for a job and return its hash"""
+    key = digest(data)
+    connection.register_script(PUT)(keys=[PREFIX + key], args=[data, UPLOAD_MAX_AGE])
+    return key
+
+
+def get(connection, key):
+    """Contents of a stored star file, or None if it has expired"""
+    return connection.hget(PREFIX + key, "data")
+
+
+def release(connection, key):
+    """The job using a stored star file has ended"""
+    connection.register_script(RELEASE)(keys=[PREFIX + key], args=[UPLOAD_TTL])
+
+
+def store(connection, config):
+    """
+    Move the star files of a job to the store, so that the job only carries
+    their hashes
+    """
+    for member in config.batch or [config]:
+        put(connection, member.star_data)
+        member.star_data = None
+
+
+def release_job(connection, config):
+    """The job using the stored star files has ended"""
+    for member in config.batch or [config]:
+        if member.star_data is None:
+            release(connection, member.star_hash)
+
+
+def read(connection, config):
+    """Contents of the star file of a job"""
+    if config.star_data is not None:
+        return config.star_data
+    data = get(connection, config.star_hash)
+    if data is None:
+        raise RuntimeError(f"Star file {config.star_hash} has expired")
+    return data
@@ -1,35 +1,51 @@
-import base64
 import sys
+import tarfile
 import traceback
+import zipfile
 from collections import Counter
 from datetime import datetime
+from functools import partial
+from io import BytesIO
 from itertools import chain
 from os import getenv
 from pathlib import Path
 
+import stars
+import uploads
 from cerberus import Validator
 from email_validator import EmailNotValidError, validate_email
-from starfit import DATA_DIR, DB, STARS, Star
+from starfit import DATA_DIR, DB, STARS
 from starfit.autils.human import time2human
 from starfit.autils.isotope import ion as I
 
+# Largest number of stars in a batch, and largest star file in an archive.
+# Archives are rejected when the files in them hold more than
+# BATCH_BYTES_MAX bytes in all or they have more than ARCHIVE_MEMBERS_MAX
+# entries, before anything beyond that is decompressed.
+BATCH_MAX = int(getenv("STARFIT_BATCH_MAX", 100))
+STAR_FILE_MAX = 2**20
+BATCH_BYTES_MAX = int(getenv("STARFIT_BATCH_BYTES_MAX", 2**26))
+ARCHIVE_MEMBERS_MAX = 4 * BATCH_MAX
+
+# Time after which a multi search stops and reports the best solutions it
+# has found so far
+MULTI_TIME_LIMIT = int(getenv("STARFIT_MULTI_TIME_LIMIT", 60 * 15))
+
 try:
     from starfit import __version__ as starfit_version
 except ImportError:
     starfit_version = "unknown"
 
 
-def convert_img_to_b64_tag(file, format):
-    plot_b64 = str(base64.b64encode(file.getvalue()))[2:-1]
+def convert_img_to_url_tag(url, format):
     if format == "pdf":
         typestr = "application/pdf"
-        img_tag = f'<iframe src="data:{typestr};base64,{plot_b64}" type="{typestr}" width="100%" height="70%"></iframe>'
+        img_tag = f'<iframe src="{url}" type="{typestr}" width="100%" height="70%" loading="lazy"></iframe>'
     else:
-        typestr = f"image/{format}"
-        if format == "svg":
-            typestr += "+xml"
-        img_tag = f'<object data="data:{typestr};base64,{plot_b64}" type="{typestr}" width="100%"'
-        img_tag += f' download="figure.{format}"></object>'
+        img_tag = f'<a href="{url}" download="figure.{format}">'
+        img_tag += (
+            f'<img src="{url}" width="100%" loading="lazy" alt="StarFit plot"></a>'
+        )
     return img_tag
 
 
@@ -51,6 +67,73 @@ def convert_element_string_to_charge_numbers(string):
     return sorted(set(elements))
 
 
+def read_sample_star(name):
+    """Contents of one of the sample star files"""
+    path = Path(DATA_DIR) / STARS / Path(name).name
+    if not path.is_file():
+        raise ValueError(f"there is no sample star {name}")
+    return path.read_bytes()
+
+
+def archive_members(data):
+    """
+    The files in a zip or tar archive, as pairs of name and content opener,
+    until the limits on the number of entries and their total size
+    """
+    if zipfile.is_zipfile(BytesIO(data)):
+        archive = zipfile.ZipFile(BytesIO(data))
+        members = (
+            (info.filename, info.file_size, info.is_dir(), info)
+            for info in archive.infolist()
+        )
+        extract = archive.open
+    else:
+        # Any tar file, compressed or not.  The members are read one by one,
+        # getmembers() would decompress the whole archive first.
+        archive = tarfile.open(fileobj=BytesIO(data))
+        members = ((info.name, info.size, not info.isfile(), info) for info in archive)
+        extract = archive.extractfile
+
+    size = 0
+    with archive:
+        for i, (name, file_size, skip, info) in enumerate(members):
+            if i == ARCHIVE_MEMBERS_MAX:
+                raise ValueError(f"more than {ARCHIVE_MEMBERS_MAX:d} entries")
+            if skip:
+                continue
+            size += file_size
+            if size > BATCH_BYTES_MAX:
+                raise ValueError(f"files larger than {BATCH_BYTES_MAX:d} bytes in all")
+            yield name, partial(extract, info)
+
+
+def read_batch_archive(data):
+    """Names and contents of the star files (*.dat) in a zip or tar archive"""
+    files = list()
+    for name, open_member in archive_members(data):
+        name = Path(name).name
+        if not name.endswith(".dat") or name.startswith("."):
+            continue
+        if len(files) == BATCH_MAX:
+            raise ValueError(f"more than {BATCH_MAX:d} star files")
+        with open_member() as f:
+            content = f.read(STAR_FILE_MAX + 1)
+        if len(content) > STAR_FILE_MAX:
+            raise ValueError(f"{name} is larger than {STAR_FILE_MAX:d} bytes")
+        files.append((name, content))
+    return files
+
+
+class BatchStar(object):
+    """One star of a batch, with the same star attributes as Config"""
+
+    def __init__(self, filename, star_data):
+        self.filename = filename
+        self.star_data = star_data
+        self.star_hash = uploads.digest(star_data)
+        self.star = None
+
+
 class Config(object):
     schema = dict(
         email={"type": "string", "coerce": str},
@@ -91,6 +174,8 @@ class Config(object):
         plot_cov={"type": "boolean", "coerce": bool},
         show_index={"type": "boolean", "coerce": bool},
         constraints={"type": "string", "coerce": str},
+        seed={"type": "string", "coerce": str},
+        warm_start={"type": "boolean", "coerce": bool},
     )
 
     def __init__(self, form):
@@ -98,7 +183,7 @@ class Config(object):
             stardata = form["stardata"]
         except:
             traceback.print_exc(file=sys.stderr)
-            sys.exit()
+            raise RuntimeError("Bad form input")
 
         self.start_time = datetime.now().strftime("%Y-%M-%d-%H-%M-%S")
 
@@ -145,33 +230,63 @@ class Config(object):
             self.mut_rate_offset = self.mut_rate_offset * 0.01
             self.mut_offset_magnitude = self.mut_offset_magnitude * 0.01
 
-        # Save files to tmp
-        if stardata.filename:
-            filepath = Path("/tmp") / (stardata.filename + self.start_time)
-            with open(filepath, "wb") as fstar:
-                fstar.write(stardata.file.read())
+        # A batch of stars, fitted one after the other with the same settings
+        self.batch = None
+        self.batch_errors = list()
+        try:
+            starbatch = form["starbatch"]
+        except KeyError:
+            starbatch = None
+        starnames = form.getfirst("starnames", None) or ""
+        try:
+            if starbatch is not None and starbatch.filename:
+                self.batch = [
+                    BatchStar(name, data)
+                    for name, data in read_batch_archive(starbatch.file.read())
+                ]
+            elif len(starnames.strip()) > 0:
+                self.batch = [
+                    BatchStar(name, read_sample_star(name))
+                    for name in starnames.replace(",", " ").split()
+                ]
+        except Exception as e:
+            traceback.print_exc(file=sys.stderr)
+            self.batch = list()
+            self.batch_errors.append(f"Bad batch of stars: {e}")
+        if self.batch is not None and len(self.batch) > BATCH_MAX:
+            self.batch_errors.append(f"Batches are limited to {BATCH_MAX:d} stars.")
+
+        # Keep the star file with the job; it is parsed in _check_for_errors
+        if self.batch is not None:
+            filename = f"{len(self.batch):d} stars"
+            star_data = None
+        elif stardata.filename:
             filename = stardata.filename
+            star_data = stardata.file.read()
         else:
             filename = self.stardefault
-            filepath = Path(DATA_DIR) / STARS / filename
+            star_data = read_sample_star(filename)
 
-        self.filepath = filepath
         self.filename = filename
+        self.star_data = star_data
+        self.star_hash = None if star_data is None else uploads.digest(star_data)
+        self.star = None
         self.dbpath = [Path(getenv("STARFIT_DATA")) / DB / db for db in self.database]
         self.mail = self.email != ""
 
         # Override time limit for some algorithms
         if self.algorithm == "multi":
-            self.time_limit = 60 * 15
+            self.time_limit = MULTI_TIME_LIMIT
         elif self.algorithm == "single":
             self.time_limit = 0
 
-        if self.time_limit < 1:
+        total_time = self.time_limit * len(self.batch or [self])
+        if total_time < 1:
             eta = "now"
-        elif self.time_limit > 600:
+        elif total_time > 600:
             eta = "in more than 10 minutes"
         else:
-            eta = "in " + time2human(self.time_limit)
+            eta = "in " + time2human(total_time)
         self.time_eta = eta
 
         if self.algorithm not in ("ga", "multi", "single"):
@@ -318,6 +433,18 @@ class Config(object):
             self.group = groups
             self.pin = pin
 
+            seed = self.seed.strip()
+            if len(seed) > 0:
+                try:
+                    seed = int(seed)
+                    assert seed >= 0
+                except:
+                    self.errors = [f"Seed: Require a non-negative integer: {seed}"]
+                    return
+            else:
+                seed = None
+            self.seed = seed
+
         elif self.algorithm == "single":
             self.sol_size = 1
 
@@ -349,6 +476,7 @@ class Config(object):
             self.pin_string = "; ".join([str(p) for p in self.pin])
             c = Counter(self.pin)
             self.pinning_string = "; ".join([f"{k}:{v}" for k, v in c.items()])
+            self.seed_string = "" if self.seed is None else str(self.seed)
 
         # Check for errors after all the config has been handled
         self.errors = self._check_for_errors()
@@ -380,12 +508,23 @@ class Config(object):
             return "Complete multitstar search"
 
     def _check_for_errors(self):
-        errors = []
-        try:
-            Star(self.filepath, silent=True)
-        except:
-            traceback.print_exc(file=sys.stderr)
-            errors += ["There is something wrong with this stellar data."]
+        errors = list(self.batch_errors)
+        if self.batch is None:
+            try:
+                self.star = stars.pack(stars.parse(self.star_data, self.filename))
+            except:
+                traceback.print_exc(file=sys.stderr)
+                errors += ["There is something wrong with this stellar data."]
+        elif len(self.batch) == 0 and len(errors) == 0:
+            errors += ["The batch does not contain any star files (*.dat)."]
+        for member in self.batch or []:
+            try:
+                member.star = stars.pack(stars.parse(member.star_data, member.filename))
+            except:
+                traceback.print_exc(file=sys.stderr)
+                errors += [
+                    f"There is something wrong with the stellar data in {member.filename}."
+                ]
 
         # Test if the input parameters are any good
         if self.sol_size > 10:
@@ -410,7 +549,14 @@ class Config(object):
 
 
 class JobInfo:
-    def __init__(self, status=None, exc_info=None):
+    def __init__(self, status=None, exc_info=None, job_id=None, elapsed=0):
         self.status = status
         self.exc_info = exc_info
+        self.job_id = job_id
+        self.elapsed = time2human(elapsed)
+        self.parts = None
+        self.wait = None
+        self.progress = None
+        self.stopping = False
+        self.refresh = 2
         self.starfit_version = starfit_version
@@ -0,0 +1,66 @@
+import hashlib
+import json
+from io import BytesIO
+from os import getenv
+from pathlib import Path
+
+import numpy as np
+
+# The best solutions of recent GA runs are kept in Redis for WARM_TTL
+# seconds after the last run, up to WARM_SIZE of them for each star,
+# database selection and solution layout, to seed reruns that ask for a
+# warm start
+WARM_SIZE = int(getenv("STARFIT_WARM_SIZE", 50))
+WARM_TTL = int(getenv("STARFIT_WARM_TTL", 7 * 86400))
+
+PREFIX = "starfit:warm:"
+
+DTYPE = np.dtype([("index", np.int64), ("offset", np.float64)])
+
+# Inputs that decide what the genes of a solution mean.  Solutions of a
+# run are only reused by runs that agree on all of them.
+KEY_FIELDS = (
+    "database",
+    "constraints",
+    "sol_size",
+    "group",
+    "pin",
+    "spread",
+)
+
+
+def key(config):
+    key = {k: getattr(config, k) for k in KEY_FIELDS}
+    key["star"] = config.star_hash
+    key["dbstat"] = list()
+    for path in config.dbpath:
+        stat = Path(path).stat()
+        key["dbstat"].append([stat.st_size, stat.st_mtime_ns])
+    text = json.dumps(key, sort_keys=True, default=str)
+    return PREFIX + hashlib.sha256(text.encode()).hexdigest()
+
+
+def get(connection, config):
+    """Stored solutions for the star and settings of `config`, or None"""
+    data = connection.get(key(config))
+    if data is None:
+        return None
+    return np.load(BytesIO(data), allow_pickle=False)
+
+
+def put(connection, config, solutions):
+    """
+    Keep the best of `solutions` (sorted best first), followed by the
+    stored solutions they do not repeat
+    """
+    solutions = np.asarray(solutions, dtype=DTYPE)
+    old = get(connection, config)
+    if old is not None and old.shape[1] == solutions.shape[1]:
+        solutions = np.concatenate((solutions, old))
+    # The first of the solutions that combine the same models
+    idx = np.sort(solutions["index"], axis=-1)
+    _, unique = np.unique(idx, axis=0, return_index=True)
+    solutions = solutions[np.sort(unique)[:WARM_SIZE]]
+    data = BytesIO()
+    np.save(data, solutions, allow_pickle=False)
+    connection.set(key(config), data.getvalue(), ex=WARM_TTL)
@@ -0,0 +1,38 @@
+from os import getenv
+
+import dbcache
+import job  # noqa: F401 - import starfit and matplotlib once per worker
+import metrics
+import plots
+from rq.worker import SimpleWorker
+
+
+class StarFitWorker(SimpleWorker):
+    """
+    Worker that runs jobs in its own process instead of forking a
+    work-horse per job, so the imports and the parsed databases in
+    `dbcache` stay resident between jobs.
+
+    STARFIT_PRELOAD_DB is a colon-separated list of database file names to
+    parse at startup; by default the databases pre-selected on the web form
+    are loaded.
+
+    LaTeX fonts are looked up once at startup by `plots.warm_up`.
+
+    The stage timings and sizes of every job are recorded by `metrics`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        names = getenv("STARFIT_PRELOAD_DB")
+        if names is not None:
+            names = [n for n in names.split(":") if len(n) > 0]
+        dbcache.preload(names)
+        plots.warm_up()
+
+    def perform_job(self, rq_job, queue):
+        metrics.begin(rq_job)
+        try:
+            return super().perform_job(rq_job, queue)
+        finally:
+            metrics.end(rq_job, rq_job.get_status())
@@ -0,0 +1,50 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+import starfit
+
+REPO = Path(__file__).resolve().parent.parent
+HTML = REPO / "roles" / "starfitweb" / "files" / "html"
+
+# The web application's modules are flat files in the html directory, and
+# tools/bench.py has the stand-ins for the web form used to build configs
+sys.path[:0] = [str(HTML), str(REPO / "tools")]
+
+DATA = Path(
+    os.environ.setdefault("STARFIT_DATA", str(Path(starfit.__file__).parent / "data"))
+)
+os.environ.setdefault("STARFIT_CACHE", tempfile.mkdtemp(prefix="starfit-cache-"))
+os.environ.setdefault("STARFIT_ARTIFACTS", tempfile.mkdtemp(prefix="starfit-jobs-"))
+os.chdir(HTML)
+
+DB = "he2sn.HW02.star.el.y.stardb.gz"
+STAR = "HE1327-2326.dat"
+
+
+@pytest.fixture
+def make_config():
+    """Config of a submission with the form defaults and `fields`"""
+    import bench
+    from utils import Config
+
+    def make(algorithm="single", database=(DB,), **fields):
+        form = bench.Form(dict(bench.FORM, algorithm=algorithm, **fields), database)
+        config = Config(form)
+        # Multi searches are only run for an email address, like in
+        # tools/bench.py the tests never mail
+        errors = [e for e in config.errors if not e.startswith("Results must be")]
+        assert errors == []
+        config.mail = False
+        return config
+
+    return make
+
+
+@pytest.fixture
+def connection():
+    """A Redis of its own for each test"""
+    fakeredis = pytest.importorskip("fakeredis")
+    return fakeredis.FakeRedis()
@@ -0,0 +1,50 @@
+import admission
+import pytest
+
+CLIENT = "192.0.2.1"
+
+
+def test_jobs_within_the_budget_are_admitted(connection, make_config):
+    config = make_config()
+    assert admission.admit(connection, config, CLIENT, 100) == ("admit", 100, 0)
+    decision, charged, _ = admission.admit(
+        connection, config, CLIENT, admission.QUOTA_BURST - 100
+    )
+    assert (decision, charged) == ("admit", admission.QUOTA_BURST - 100)
+
+
+def test_over_budget_is_rejected_without_charge(connection, make_config):
+    config = make_config()
+    admission.admit(connection, config, CLIENT, admission.QUOTA_BURST)
+    decision, charged, wait = admission.admit(connection, config, CLIENT, 100)
+    assert (decision, charged) == ("reject", 0)
+    assert wait == pytest.approx(100 / admission.QUOTA_RATE, abs=1)
+    # Nothing was charged, the same wait still applies
+    assert admission.admit(connection, config, CLIENT, 100)[2] <= wait
+    # Other clients have their own budget
+    assert admission.admit(connection, config, "192.0.2.2", 100)[0] == "admit"
+
+
+def test_mailed_jobs_over_budget_are_deferred(connection, make_config):
+    config = make_config()
+    admission.admit(connection, config, CLIENT, admission.QUOTA_BURST)
+    config.mail = True
+    config.email = "someone@example.com"
+    decision, charged, wait = admission.admit(connection, config, CLIENT, 100)
+    assert (decision, charged) == ("defer", 100)
+    assert 0 < wait <= admission.QUOTA_MAX_DEFER
+    # Beyond the longest deferral it is rejected
+    cost = admission.QUOTA_MAX_DEFER * admission.QUOTA_RATE * 2
+    assert admission.admit(connection, config, CLIENT, cost)[0] == "reject"
+
+
+def test_ga_over_budget_is_downgraded(connection, make_config):
+    config = make_config("ga")
+    admission.admit(connection, config, CLIENT, admission.QUOTA_BURST - 300)
+    decision, charged, _ = admission.admit(connection, config, CLIENT, 600)
+    assert decision == "downgrade"
+    assert charged == pytest.approx(300, abs=1)
+    admission.downgrade(config, charged)
+    assert config.time_limit == int(charged)
+    # Below the shortest time limit it is rejected
+    assert admission.admit(connection, config, CLIENT, 600)[0] == "reject"
@@ -0,0 +1,40 @@
+import islands
+import numpy as np
+import solvers
+from conftest import DATA, DB, STAR
+
+
+def ga_options():
+    return dict(
+        filename=str(DATA / "stars" / STAR),
+        db=str(DATA / "db" / DB),
+        silent=True,
+        sol_size=2,
+        seed=1,
+        gen=40,
+        # The number of generations ends every epoch, not the clock
+        time_limit=600,
+    )
+
+
+def test_search_is_set_up_once_per_process(monkeypatch):
+    calls = list()
+    setup = solvers.PackedSetup._setup
+
+    def counted(self, *args, **kwargs):
+        calls.append(1)
+        setup(self, *args, **kwargs)
+
+    monkeypatch.setattr(solvers.PackedSetup, "_setup", counted)
+    ga = islands.run_islands(ga_options(), n_islands=1, n_migrations=3)
+    assert ga.gen == 40
+    assert len(calls) == 1
+
+
+def test_reused_setup_gives_the_same_run(monkeypatch):
+    ga = islands.run_islands(ga_options(), n_islands=2, n_migrations=2)
+    # Set up every epoch again
+    monkeypatch.setattr(islands.IslandGa, "_setup", solvers.SeededGa._setup)
+    reference = islands.run_islands(ga_options(), n_islands=2, n_migrations=2)
+    assert np.array_equal(ga.s["index"], reference.s["index"])
+    assert np.allclose(ga.f, reference.f)
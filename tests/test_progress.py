@@ -0,0 +1,40 @@
+import job
+import progress
+from rq import Queue
+
+
+def leader_and_follower(connection, config):
+    leader = Queue("test", connection=connection).enqueue("builtins.print")
+    follower = job.follow(connection, config, leader, "test")
+    assert follower.get_status() == "deferred"
+    assert leader.dependent_ids == [follower.id]
+    return leader, follower
+
+
+def test_lapsed_follower_is_dropped(connection, make_config):
+    leader, follower = leader_and_follower(connection, make_config())
+    assert progress.abandoned(connection, leader.id)
+    assert follower.get_status(refresh=True) == "canceled"
+    assert leader.dependent_ids == []
+
+
+def test_polled_follower_keeps_the_leader(connection, make_config):
+    leader, follower = leader_and_follower(connection, make_config())
+    progress.renew(connection, follower.id)
+    assert not progress.abandoned(connection, leader.id)
+    assert leader.dependent_ids == [follower.id]
+
+
+def test_mailed_follower_keeps_the_leader(connection, make_config):
+    config = make_config()
+    config.mail = True
+    leader, follower = leader_and_follower(connection, config)
+    assert not progress.abandoned(connection, leader.id)
+
+
+def test_leased_leader_is_not_abandoned(connection, make_config):
+    leader = Queue("test", connection=connection).enqueue("builtins.print")
+    progress.renew(connection, leader.id)
+    assert not progress.abandoned(connection, leader.id)
+    progress.clear(connection, leader.id)
+    assert progress.abandoned(connection, leader.id)
@@ -0,0 +1,33 @@
+import resultcache
+
+
+def test_key_depends_on_the_fit_not_on_the_mail(make_config):
+    config = make_config("single")
+    key = resultcache.job_key(config)
+    assert key is not None
+    assert resultcache.job_key(make_config("single")) == key
+    config.email = "someone@example.com"
+    assert resultcache.job_key(config) == key
+    assert resultcache.job_key(make_config("single", z_exclude="Li")) != key
+    assert resultcache.job_key(make_config("multi", sol_sizes="2")) != key
+
+
+def test_ga_without_seed_is_not_cached(make_config):
+    assert resultcache.job_key(make_config("ga")) is None
+
+
+def test_ga_with_time_limit_is_not_cached(make_config):
+    config = make_config("ga", seed="7")
+    assert config.time_limit > 0
+    assert resultcache.job_key(config) is None
+
+
+def test_ga_with_islands_is_not_cached(make_config, monkeypatch):
+    config = make_config("ga", seed="7")
+    config.time_limit = 0
+    monkeypatch.setattr(resultcache.islands, "GA_ISLANDS", 4)
+    assert resultcache.job_key(config) is None
+    monkeypatch.setattr(resultcache.islands, "GA_ISLANDS", 1)
+    assert resultcache.job_key(config) is not None
+    config.warm_start = True
+    assert resultcache.job_key(config) is None
@@ -0,0 +1,53 @@
+import numpy as np
+from conftest import DATA, DB, STAR
+from starfit import Multi
+
+
+def multi_options():
+    return dict(
+        filename=str(DATA / "stars" / STAR),
+        db=str(DATA / "db" / DB),
+        silent=True,
+        sol_size=2,
+        save=False,
+        threads=2,
+    )
+
+
+def test_finished_multi_shuts_down_its_pool():
+    from solvers import ReportingMulti
+
+    search = ReportingMulti(**multi_options())
+    assert not search.stopped
+    assert search.executor._shutdown_thread
+    assert not search.executor._processes
+
+
+def test_reporting_multi_finds_the_best_solutions_of_multi():
+    from solvers import ReportingMulti
+
+    search = ReportingMulti(**multi_options())
+    reference = Multi(**multi_options())
+    assert np.allclose(search.sorted_fitness[:10], reference.sorted_fitness[:10])
+
+
+def test_merged_shards_find_the_best_solutions_of_multi():
+    from solvers import MergedMulti, ShardedMulti
+
+    top_stars = list()
+    top_fitness = list()
+    for shard in range(3):
+        search = ShardedMulti(**multi_options(), shard=shard, n_shards=3)
+        found = np.isfinite(search.top_fitness)
+        top_stars.append(search.top_stars[found])
+        top_fitness.append(search.top_fitness[found])
+    merged = MergedMulti(
+        **multi_options(), top_stars=top_stars, top_fitness=top_fitness
+    )
+    reference = Multi(**multi_options())
+    assert len(merged.sorted_fitness) == len(reference.sorted_fitness)
+    assert np.allclose(merged.sorted_fitness, reference.sorted_fitness)
+    assert np.array_equal(
+        np.sort(merged.sorted_stars["index"], axis=1),
+        np.sort(reference.sorted_stars["index"], axis=1),
+    )
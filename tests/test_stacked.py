@@ -0,0 +1,46 @@
+import numpy as np
+from conftest import DATA, DB
+from starfit import Single
+
+# Stars and the elements left out of their fits.  Without their upper
+# limits the first three have the closed form of `fit_stack`, the last is
+# solved on its own.
+STARS = [
+    ("Cayrel2004.dat", ["H", "He"]),
+    ("HE0107-5240.dat", ["H", "He", "V", "Cr"]),
+    ("BD_80_245.dat", ["H", "He", "O", "Cu", "Y"]),
+    ("HE1327-2326.dat", []),
+]
+
+
+def options(star, z_exclude):
+    return dict(
+        filename=str(DATA / "stars" / star),
+        db=str(DATA / "db" / DB),
+        z_exclude=z_exclude,
+        silent=True,
+    )
+
+
+def test_fit_stack_ranks_models_like_single():
+    import stacked
+    from solvers import PreparedSingle
+
+    searches = [PreparedSingle(**options(*star)) for star in STARS]
+    # A chunk size that does not divide the database
+    stacked.fit_stack(searches, chunk=97)
+    assert [stacked.stackable(search) for search in searches] == [
+        True,
+        True,
+        True,
+        False,
+    ]
+    for star, search in zip(STARS, searches):
+        reference = Single(**options(*star))
+        n = min(20, len(reference.sorted_fitness))
+        assert np.allclose(
+            search.sorted_fitness[:n], reference.sorted_fitness[:n], rtol=1e-6
+        ), star
+        assert np.allclose(
+            search.sorted_stars.offset[:n], reference.sorted_stars.offset[:n]
+        ), star
@@ -0,0 +1,35 @@
+import supervisor
+
+INTERACTIVE = ("interactive",)
+STANDARD = ("standard", "interactive")
+BATCH = ("batch", "standard", "interactive")
+GROUPS = {
+    INTERACTIVE: ["01", "02"],
+    STANDARD: ["03", "04", "05"],
+    BATCH: ["06", "07", "08"],
+}
+
+
+def test_idle_slices_keep_their_minimum():
+    want = supervisor.plan(GROUPS, set(), {}, 8)
+    assert want == {INTERACTIVE: 1, STANDARD: 1, BATCH: 1}
+
+
+def test_busy_and_queued_workers_up_to_the_slice_size():
+    want = supervisor.plan(GROUPS, {"03"}, {"standard": 1, "batch": 5}, 8)
+    assert want == {INTERACTIVE: 1, STANDARD: 2, BATCH: 3}
+
+
+def test_only_the_first_queue_of_a_slice_counts():
+    want = supervisor.plan(GROUPS, set(), {"interactive": 2}, 8)
+    assert want == {INTERACTIVE: 2, STANDARD: 1, BATCH: 1}
+
+
+def test_over_the_limit_expensive_slices_are_cut_first():
+    want = supervisor.plan(GROUPS, set(), {"standard": 3, "batch": 3}, 5)
+    assert want == {INTERACTIVE: 1, STANDARD: 3, BATCH: 1}
+
+
+def test_busy_workers_are_not_cut():
+    want = supervisor.plan(GROUPS, {"06", "07"}, {"standard": 3}, 4)
+    assert want == {INTERACTIVE: 1, STANDARD: 1, BATCH: 2}
@@ -0,0 +1,55 @@
+import io
+import tarfile
+import zipfile
+
+import pytest
+import utils
+
+
+def zip_archive(files):
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, content in files:
+            archive.writestr(name, content)
+    return data.getvalue()
+
+
+def tar_archive(files):
+    data = io.BytesIO()
+    with tarfile.open(fileobj=data, mode="w:gz") as archive:
+        for name, content in files:
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            archive.addfile(info, io.BytesIO(content))
+    return data.getvalue()
+
+
+@pytest.fixture(params=[zip_archive, tar_archive])
+def archive(request):
+    return request.param
+
+
+def test_star_files_are_read(archive):
+    files = [("stars/a.dat", b"a"), ("README", b"r"), ("stars/._a.dat", b"x")]
+    assert utils.read_batch_archive(archive(files)) == [("a.dat", b"a")]
+
+
+def test_too_many_star_files(archive, monkeypatch):
+    monkeypatch.setattr(utils, "BATCH_MAX", 2)
+    files = [(f"{i}.dat", b"s") for i in range(3)]
+    with pytest.raises(ValueError, match="more than 2 star files"):
+        utils.read_batch_archive(archive(files))
+
+
+def test_too_many_entries(archive, monkeypatch):
+    monkeypatch.setattr(utils, "ARCHIVE_MEMBERS_MAX", 5)
+    files = [(f"{i}.txt", b"s") for i in range(6)]
+    with pytest.raises(ValueError, match="more than 5 entries"):
+        utils.read_batch_archive(archive(files))
+
+
+def test_too_large_in_all(archive, monkeypatch):
+    monkeypatch.setattr(utils, "BATCH_BYTES_MAX", 2**16)
+    files = [(f"{i}.txt", bytes(2**15)) for i in range(3)]
+    with pytest.raises(ValueError, match="larger than 65536 bytes in all"):
+        utils.read_batch_archive(archive(files))
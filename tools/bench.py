@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+Benchmark `job.run_job` outside the web server and the job queue.
+
+Runs a matrix of algorithms, sample stars and a selection of databases
+through the same code path as the workers (with mail, the result cache and
+the splitting of multi searches disabled) and writes the wall time of every
+stage, the peak memory and the output sizes of each run to a JSON file.
+Every run is forked from a process that has already loaded the databases,
+like a worker does.
+
+    python3 tools/bench.py --data /var/www/html/data --out base.json
+    python3 tools/bench.py --data /var/www/html/data --compare base.json
+
+The results record the git commit of this checkout, so files from two
+commits can be compared with --compare.
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+from multiprocessing import get_context
+from pathlib import Path
+from statistics import median
+
+REPO = Path(__file__).resolve().parent.parent
+HTML = REPO / "roles" / "starfitweb" / "files" / "html"
+
+# Defaults of the web form (templates/home.html); unchecked boxes are None
+FORM = dict(
+    email="",
+    algorithm="single",
+    sol_size="2",
+    sol_sizes="",
+    z_min="H",
+    z_max="Zn",
+    combine_mode="0",
+    pop_size="200",
+    yscale="2",
+    time_limit="5",
+    gen="1000",
+    tour_size="2",
+    frac_mating_pool="100",
+    frac_elite="50",
+    mut_rate_index="20",
+    mut_rate_offset="10",
+    mut_offset_magnitude="100",
+    fixed=None,
+    plotformat="svg",
+    stardefault="HE1327-2326.dat",
+    z_exclude="Li, Cr, Zn",
+    z_lolim="Sc, Cu",
+    upper_lim="true",
+    cdf="true",
+    det=None,
+    cov=None,
+    dst=None,
+    limit_solution="true",
+    limit_solver="true",
+    spread="true",
+    local_search="true",
+    group_ga="",
+    group_multi="",
+    pin="",
+    multi="0",
+    plot_cov=None,
+    show_index=None,
+    constraints="",
+    seed="",
+)
+
+
+class Upload(object):
+    """An empty file field: the star is one of the bundled ones"""
+
+    filename = ""
+    file = None
+
+
+class Form(dict):
+    """Stands in for the cgi.FieldStorage read by utils.Config"""
+
+    def __init__(self, fields, database):
+        super().__init__(fields)
+        self["stardata"] = Upload()
+        self.database = list(database)
+
+    def getfirst(self, key, default=None):
+        return self.get(key, default)
+
+    def getlist(self, key):
+        if key == "database":
+            return self.database
+        return [self[key]] if key in self else []
+
+
+class BenchJob(object):
+    """Stands in for the RQ job running `job.run_job`"""
+
+    connection = None
+    origin = "bench"
+    func_name = "job.run_job"
+    enqueued_at = None
+
+    def __init__(self, job_id, config):
+        self.id = job_id
+        self.args = (config,)
+
+
+def case_fields(case, args):
+    fields = dict(FORM, algorithm=case["algorithm"], stardefault=case["star"])
+    if case["algorithm"] == "ga":
+        # A fixed number of generations and seed, so runs do the same work
+        fields.update(
+            gen=str(args.gen), time_limit="60", seed=str(args.seed), sol_size="2"
+        )
+    elif case["algorithm"] == "multi":
+        fields.update(sol_sizes=args.sol_sizes)
+    fields.update(args.field)
+    return fields
+
+
+def run_case(case, args, pipe):
+    """Run one case in this (forked) process and send back its record"""
+    import artifacts
+    import job
+    import metrics
+    from utils import Config
+
+    record = dict(case=case, ok=False)
+    try:
+        config = Config(Form(case_fields(case, args), case["db"]))
+        # The web form requires an email address for multi searches, but
+        # the benchmark never mails
+        errors = [e for e in config.errors if not e.startswith("Results must be")]
+        if len(errors) > 0:
+            raise RuntimeError("; ".join(errors))
+        config.cache_key = None
+        config.mail = False
+
+        job.MULTI_SHARDS = 1
+        bench_job = BenchJob(f"bench-{os.getpid():d}-{time.time_ns():d}", config)
+        metrics.begin(bench_job)
+        start = time.perf_counter()
+        manifest = job.run_job(config, job=bench_job)
+        record["wall"] = time.perf_counter() - start
+        stages = metrics.finish("finished")
+        record["stages"] = stages["stages"]
+        record["sizes"] = stages["sizes"]
+        record["artifact_bytes"] = sum(
+            f.stat().st_size for f in artifacts.job_dir(manifest["job_id"]).iterdir()
+        )
+        record["ok"] = True
+    except:
+        traceback.print_exc(file=sys.stderr)
+        record["error"] = traceback.format_exc(limit=1)
+
+    # ru_maxrss is in kiB on Linux
+    record["peak_rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    record["peak_rss_children"] = (
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+    )
+    pipe.send(record)
+    pipe.close()
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=REPO,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=REPO,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        return commit, len(dirty) > 0
+    except:
+        return None, None
+
+
+def case_key(case):
+    return f"{case['algorithm']} {case['star']} {'+'.join(case['db'])}"
+
+
+def summary(results):
+    """Median wall time and stage times of each case"""
+    runs = dict()
+    for record in results:
+        if record["ok"]:
+            runs.setdefault(case_key(record["case"]), list()).append(record)
+    out = dict()
+    for key, records in runs.items():
+        stages = set().union(*(r["stages"] for r in records))
+        out[key] = dict(
+            wall=median(r["wall"] for r in records),
+            stages={
+                s: median(r["stages"].get(s, 0.0) for r in records) for s in stages
+            },
+        )
+    return out
+
+
+def compare(base, results):
+    old = summary(base["results"])
+    new = summary(results)
+    print(f"base: {base['commit']}")
+    for key in sorted(new):
+        if key not in old:
+            continue
+        a = old[key]
+        b = new[key]
+        print(
+            f"{key}: {a['wall']:.3f} s -> {b['wall']:.3f} s ({b['wall'] / a['wall']:.2f}x)"
+        )
+        for s in sorted(b["stages"]):
+            t0 = a["stages"].get(s, 0.0)
+            t1 = b["stages"][s]
+            ratio = f"{t1 / t0:.2f}x" if t0 > 0 else "new"
+            print(f"    {s:<8} {t0:8.3f} s -> {t1:8.3f} s ({ratio})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--data",
+        default=os.environ.get("STARFIT_DATA", "/var/www/html/data"),
+        help="StarFit data directory (with db/ and stars/)",
+    )
+    parser.add_argument("--algorithms", nargs="+", default=["single", "multi", "ga"])
+    parser.add_argument(
+        "--stars", nargs="+", help="star files in data/stars (default: all)"
+    )
+    parser.add_argument(
+        "--db",
+        nargs="+",
+        default=["he2sn.HW02.star.el.y.stardb.gz", "rproc.just15.star.el.y.stardb.xz"],
+        help="databases in data/db, selected together for every case",
+    )
+    parser.add_argument(
+        "--sol-sizes",
+        default="",
+        help="multi: stars per group (default: one per database)",
+    )
+    parser.add_argument("--gen", type=int, default=200, help="ga: generations")
+    parser.add_argument("--seed", type=int, default=1, help="ga: random seed")
+    parser.add_argument(
+        "--field",
+        nargs=2,
+        action="append",
+        default=[],
+        metavar=("NAME", "VALUE"),
+        help="override a form field",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--cold", action="store_true", help="do not load the databases beforehand"
+    )
+    parser.add_argument("--out", default="bench.json")
+    parser.add_argument("--compare", help="results file to compare against")
+    args = parser.parse_args()
+    args.field = dict(args.field)
+    args.out = Path(args.out).resolve()
+    if args.compare is not None:
+        args.compare = Path(args.compare).resolve()
+
+    work = tempfile.TemporaryDirectory(prefix="starfit-bench-")
+    os.environ["STARFIT_DATA"] = str(Path(args.data).resolve())
+    # Keep the outputs away from those of the server
+    os.environ["STARFIT_ARTIFACTS"] = work.name
+    os.environ["STARFIT_CACHE"] = work.name
+    os.chdir(HTML)
+    sys.path.insert(0, str(HTML))
+
+    import dbcache
+    import job  # noqa: F401 - import starfit and matplotlib before forking
+    from utils import starfit_version
+
+    if args.stars is None:
+        args.stars = sorted(p.name for p in (Path(args.data) / "stars").glob("*.dat"))
+    if not args.cold:
+        dbcache.load([Path(args.data) / "db" / name for name in args.db])
+
+    cases = [
+        dict(algorithm=algorithm, star=star, db=args.db)
+        for algorithm in args.algorithms
+        for star in args.stars
+    ]
+
+    ctx = get_context("fork")
+    results = list()
+    for case in cases:
+        for i in range(args.repeat):
+            receiver, sender = ctx.Pipe(duplex=False)
+            process = ctx.Process(target=run_case, args=(case, args, sender))
+            process.start()
+            sender.close()
+            try:
+                record = receiver.recv()
+            except EOFError:
+                record = dict(case=case, ok=False, error="benchmark process died")
+            process.join()
+            record["run"] = i
+            results.append(record)
+            status = f"{record['wall']:.3f} s" if record["ok"] else "failed"
+            print(f"{case_key(case)} #{i:d}: {status}", file=sys.stderr)
+
+    commit, dirty = git_commit()
+    output = dict(
+        commit=commit,
+        dirty=dirty,
+        starfit_version=starfit_version,
+        python=platform.python_version(),
+        host=platform.node(),
+        cpus=os.cpu_count(),
+        time=time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        settings={k: v for k, v in os.environ.items() if k.startswith("STARFIT_")},
+        args={k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()},
+        results=results,
+    )
+    with open(args.out, "w") as f:
+        json.dump(output, f, indent=1)
+
+    if args.compare is not None:
+        with open(args.compare, "r") as f:
+            compare(json.load(f), results)
+    work.cleanup()
+
+
+if __name__ == "__main__":
+    main()
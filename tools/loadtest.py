@@ -0,0 +1,459 @@
+#!/usr/bin/env python3
+"""
+Load test of the whole submit -> queue -> worker -> result path.
+
+Starts a private Redis (redis-server if installed, otherwise fakeredis),
+a number of RQ workers, the mail worker and an SMTP sink, and replays a
+mix of form submissions against the `run` view of the web application
+from concurrent clients.  Each client submits a job, waits for its result
+and submits the next one (a closed loop).  For every concurrency level the
+throughput, the submit-to-result latency, the queue wait and the failure
+rate are reported, and all samples are written to a JSON file.
+
+    python3 tools/loadtest.py --data /var/www/html/data --workers 4 \\
+        --concurrency 1 2 4 8 --duration 120 --email you@your.domain
+
+Jobs that are mailed (all multi searches, and --mail-fraction of the
+others) need an --email address that passes the web form's validation;
+the mails only go to the sink.  Use redis-server (or --redis) for numbers
+to size a deployment by; fakeredis is only good enough to try the harness.
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from io import BytesIO
+from pathlib import Path
+
+import numpy as np
+
+REPO = Path(__file__).resolve().parent.parent
+HTML = REPO / "roles" / "starfitweb" / "files" / "html"
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench import FORM  # noqa: E402 - the web form defaults
+
+QUEUES = "interactive standard batch"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Nothing is listening on port {port:d}")
+
+
+class Stack(object):
+    """Redis, RQ workers, mail worker and SMTP sink in a scratch directory"""
+
+    def __init__(self, args):
+        self.args = args
+        self.work = Path(tempfile.mkdtemp(prefix="starfit-loadtest-"))
+        self.processes = list()
+
+    def spawn(self, name, command, env=None):
+        log = open(self.work / f"{name}.log", "w")
+        self.processes.append(
+            subprocess.Popen(
+                command,
+                cwd=HTML,
+                env=env,
+                stdout=log,
+                stderr=subprocess.STDOUT,
+            )
+        )
+
+    def start(self):
+        args = self.args
+        if args.redis is not None:
+            self.redis_url = args.redis
+        else:
+            port = free_port()
+            if shutil.which("redis-server") is not None:
+                command = ["redis-server", "--port", str(port), "--save", ""]
+                command += ["--appendonly", "no", "--dir", str(self.work)]
+            else:
+                command = [
+                    sys.executable,
+                    "-c",
+                    "from fakeredis import TcpFakeServer; "
+                    f"TcpFakeServer(('127.0.0.1', {port:d}), server_type='redis')"
+                    ".serve_forever()",
+                ]
+            self.spawn("redis", command)
+            wait_for_port(port)
+            self.redis_url = f"redis://127.0.0.1:{port:d}/0"
+
+        smtp_port = free_port()
+        self.mail_dir = self.work / "mail"
+        self.spawn(
+            "smtp",
+            [
+                sys.executable,
+                str(REPO / "tools" / "smtp_sink.py"),
+                "--port",
+                str(smtp_port),
+                "--dir",
+                str(self.mail_dir),
+            ],
+        )
+        wait_for_port(smtp_port)
+
+        # Settings shared by the web application (this process) and workers
+        os.environ.update(
+            STARFIT_DATA=str(Path(args.data).resolve()),
+            STARFIT_CACHE=str(self.work / "cache"),
+            STARFIT_ARTIFACTS=str(self.work / "jobs"),
+            STARFIT_SMTP_HOST="127.0.0.1",
+            STARFIT_SMTP_PORT=str(smtp_port),
+            STARFIT_PRELOAD_DB=":".join(args.db),
+        )
+
+        rq = [sys.executable, "-m", "rq.cli", "worker", "--url", self.redis_url]
+        for i in range(args.workers):
+            self.spawn(
+                f"worker-{i:02d}",
+                [
+                    *rq,
+                    "-w",
+                    "worker.StarFitWorker",
+                    "--with-scheduler",
+                    *QUEUES.split(),
+                ],
+            )
+        self.spawn(
+            "mail-worker",
+            rq + ["-w", "mailer.MailWorker", "--with-scheduler", "mail"],
+        )
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if not self.args.keep:
+            shutil.rmtree(self.work, ignore_errors=True)
+
+    def mails(self):
+        if not self.mail_dir.is_dir():
+            return 0
+        return len(list(self.mail_dir.glob("*.eml")))
+
+
+def encode_form(fields, upload):
+    """multipart/form-data body as sent by the browser"""
+    boundary = uuid.uuid4().hex
+    parts = list()
+    for key, value in fields.items():
+        values = value if isinstance(value, list) else [value]
+        for v in values:
+            if v is None:
+                continue
+            parts.append(
+                f'--{boundary}\r\nContent-Disposition: form-data; name="{key}"'
+                f"\r\n\r\n{v}\r\n".encode()
+            )
+    filename, data = upload
+    parts.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="stardata"; '
+        f'filename="{filename}"\r\nContent-Type: application/octet-stream\r\n\r\n'.encode()
+    )
+    parts.append(data + b"\r\n")
+    body = b"".join(parts) + f"--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+class Workload(object):
+    """Random form submissions following the mix given on the command line"""
+
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.lock = threading.Lock()
+        star_dir = Path(args.data) / "stars"
+        self.stars = sorted(p.name for p in star_dir.glob("*.dat"))
+        self.star_dir = star_dir
+        names, weights = zip(*args.mix.items())
+        self.algorithms = names
+        self.weights = weights
+
+    def next(self):
+        args = self.args
+        with self.lock:
+            algorithm = self.rng.choices(self.algorithms, self.weights)[0]
+            star = self.rng.choice(self.stars)
+            upload = self.rng.random() < args.upload_fraction
+            mail = algorithm == "multi" or self.rng.random() < args.mail_fraction
+
+        fields = dict(FORM, algorithm=algorithm, stardefault=star)
+        fields["database"] = list(args.db)
+        if mail:
+            fields["email"] = args.email
+        if algorithm == "ga":
+            fields["time_limit"] = str(args.ga_time)
+        elif algorithm == "multi":
+            fields["sol_sizes"] = args.sol_sizes
+        if upload:
+            filedata = (star, (self.star_dir / star).read_bytes())
+        else:
+            filedata = ("", b"")
+        return algorithm, fields, filedata
+
+
+class Client(threading.Thread):
+    """Submits jobs one after the other until the step ends"""
+
+    def __init__(self, index, step, app, workload, samples):
+        super().__init__(daemon=True)
+        self.address = f"10.{index // 65536:d}.{index // 256 % 256:d}.{index % 256:d}"
+        self.step = step
+        self.app = app
+        self.workload = workload
+        self.samples = samples
+
+    def submit(self, fields, upload):
+        body, content_type = encode_form(fields, upload)
+        environ = {
+            "REQUEST_METHOD": "POST",
+            "SCRIPT_NAME": "",
+            "PATH_INFO": "/run",
+            "QUERY_STRING": "",
+            "CONTENT_TYPE": content_type,
+            "CONTENT_LENGTH": str(len(body)),
+            "REMOTE_ADDR": self.address,
+            "wsgi.input": BytesIO(body),
+        }
+        status = list()
+        page = b"".join(
+            self.app.application(environ, lambda s, h, e=None: status.append(s))
+        )
+        return status[0], page.decode()
+
+    def run(self):
+        from rq.exceptions import NoSuchJobError
+        from rq.job import Job
+
+        while time.time() < self.step["end"]:
+            algorithm, fields, upload = self.workload.next()
+            sample = dict(algorithm=algorithm, concurrency=self.step["concurrency"])
+            start = time.time()
+            try:
+                status, page = self.submit(fields, upload)
+            except Exception as e:
+                status, page = "500", repr(e)
+            sample["submit"] = time.time() - start
+
+            if not status.startswith("200"):
+                sample["outcome"] = "error"
+                sample["error"] = f"{status}: {page[-200:]}"
+            elif "status?id=" in page:
+                job_id = page.split("status?id=")[1].split('"')[0]
+                sample.update(self.follow(Job, NoSuchJobError, job_id, start))
+            elif "Best fitting" in page:
+                sample["outcome"] = "cached"
+                sample["latency"] = sample["submit"]
+            elif "share of the computing time" in page:
+                sample["outcome"] = "rejected"
+            else:
+                sample["outcome"] = "invalid"
+            self.samples.append(sample)
+
+    def follow(self, Job, NoSuchJobError, job_id, start):
+        """Wait for a job (and the job continuing it) to end"""
+        connection = self.app.redis
+        deadline = start + self.workload.args.timeout
+        wait = None
+        while time.time() < deadline:
+            try:
+                job = Job.fetch(job_id, connection=connection)
+                if wait is None and job.started_at is not None:
+                    wait = job.started_at.timestamp() - job.enqueued_at.timestamp()
+                while "continued_by" in job.meta:
+                    job = Job.fetch(job.meta["continued_by"], connection=connection)
+                status = job.get_status()
+            except NoSuchJobError:
+                return dict(outcome="lost", wait=wait)
+            if status == "finished":
+                return dict(
+                    outcome="finished",
+                    wait=wait,
+                    latency=job.ended_at.timestamp() - start,
+                    queue=job.origin,
+                )
+            if status in ("failed", "stopped", "canceled"):
+                return dict(outcome="failed", wait=wait)
+            time.sleep(0.2)
+        return dict(outcome="timeout", wait=wait)
+
+
+def percentiles(values):
+    if len(values) == 0:
+        return dict(p50=None, p95=None, p99=None)
+    p = np.percentile(values, [50, 95, 99])
+    return dict(p50=float(p[0]), p95=float(p[1]), p99=float(p[2]))
+
+
+def report(step, samples):
+    n = len(samples)
+    outcomes = dict()
+    for s in samples:
+        outcomes[s["outcome"]] = outcomes.get(s["outcome"], 0) + 1
+    done = [s for s in samples if "latency" in s]
+    failed = sum(outcomes.get(k, 0) for k in ("error", "failed", "lost", "timeout"))
+    return dict(
+        concurrency=step["concurrency"],
+        duration=step["duration"],
+        submitted=n,
+        outcomes=outcomes,
+        throughput=len(done) / step["duration"],
+        failure_rate=failed / n if n > 0 else 0.0,
+        latency=percentiles([s["latency"] for s in done]),
+        wait=percentiles([s["wait"] for s in samples if s.get("wait") is not None]),
+        submit=percentiles([s["submit"] for s in samples]),
+    )
+
+
+def fmt(p):
+    if p["p50"] is None:
+        return "-"
+    return f"{p['p50']:.2f}/{p['p95']:.2f}/{p['p99']:.2f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--data",
+        default=os.environ.get("STARFIT_DATA", "/var/www/html/data"),
+        help="StarFit data directory (with db/ and stars/)",
+    )
+    parser.add_argument(
+        "--db",
+        nargs="+",
+        default=["he2sn.HW02.star.el.y.stardb.gz", "rproc.just15.star.el.y.stardb.xz"],
+        help="databases in data/db, selected together for every job",
+    )
+    parser.add_argument(
+        "--mix",
+        default="single=0.7,ga=0.25,multi=0.05",
+        help="algorithms and their weights",
+    )
+    parser.add_argument("--ga-time", type=int, default=5, help="ga: time limit")
+    parser.add_argument(
+        "--sol-sizes", default="", help="multi: stars per group (one per database)"
+    )
+    parser.add_argument("--email", help="address for jobs that are mailed")
+    parser.add_argument("--mail-fraction", type=float, default=0.2)
+    parser.add_argument("--upload-fraction", type=float, default=0.5)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument(
+        "--duration", type=float, default=60, help="seconds of submissions per level"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=900, help="longest wait for one job"
+    )
+    parser.add_argument("--redis", help="URL of a Redis to use instead of a new one")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--keep", action="store_true", help="keep logs and outputs")
+    parser.add_argument("--out", default="loadtest.json")
+    args = parser.parse_args()
+
+    args.mix = {
+        name: float(weight)
+        for name, weight in (item.split("=") for item in args.mix.split(","))
+    }
+    if args.email is None and (args.mix.get("multi", 0) > 0 or args.mail_fraction > 0):
+        parser.error("--email is needed for multi searches and mailed jobs")
+    args.out = Path(args.out).resolve()
+
+    stack = Stack(args)
+    stack.start()
+    try:
+        os.chdir(HTML)
+        sys.path.insert(0, str(HTML))
+        import app
+        from redis import Redis
+
+        app.redis = Redis.from_url(stack.redis_url)
+        workload = Workload(args)
+
+        # Give the workers time to start and load the databases
+        time.sleep(10)
+
+        results = list()
+        samples = list()
+        print(
+            "clients  jobs  done/s  failed  latency p50/p95/p99 s  "
+            "wait p50/p95/p99 s  submit p50/p95/p99 s"
+        )
+        for concurrency in args.concurrency:
+            step = dict(
+                concurrency=concurrency,
+                duration=args.duration,
+                end=time.time() + args.duration,
+            )
+            step_samples = list()
+            clients = [
+                Client(i, step, app, workload, step_samples) for i in range(concurrency)
+            ]
+            for client in clients:
+                client.start()
+            for client in clients:
+                client.join()
+            # Clients finish their last job after the end of the step
+            step["duration"] = max(
+                args.duration, time.time() - (step["end"] - args.duration)
+            )
+            result = report(step, step_samples)
+            results.append(result)
+            samples.extend(step_samples)
+            print(
+                f"{concurrency:7d} {result['submitted']:5d} {result['throughput']:7.3f} "
+                f"{result['failure_rate']:7.1%}  {fmt(result['latency']):>21s}  "
+                f"{fmt(result['wait']):>18s}  {fmt(result['submit']):>20s}"
+            )
+
+        # Let the mail worker catch up before counting
+        time.sleep(5)
+        output = dict(
+            args={
+                k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()
+            },
+            redis=stack.redis_url,
+            mails_delivered=stack.mails(),
+            levels=results,
+            samples=samples,
+        )
+        with open(args.out, "w") as f:
+            json.dump(output, f, indent=1)
+        print(f"{stack.mails():d} mails delivered; results in {args.out}")
+        if args.keep:
+            print(f"logs and outputs in {stack.work}")
+    finally:
+        stack.stop()
+
+
+if __name__ == "__main__":
+    main()
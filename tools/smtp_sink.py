@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Stand-in SMTP server for testing the mail queue without a real MTA.
+
+Accepts every message and writes it to a directory, one file per message.
+Point the mail worker at it with STARFIT_SMTP_HOST/STARFIT_SMTP_PORT, e.g.
+
+    python tools/smtp_sink.py --port 2525 --dir /tmp/starfit-mail
+    STARFIT_SMTP_HOST=127.0.0.1 STARFIT_SMTP_PORT=2525 \\
+        rq worker -w mailer.MailWorker --with-scheduler mail
+"""
+
+import argparse
+import socketserver
+import sys
+import threading
+from pathlib import Path
+
+counter = 0
+counter_lock = threading.Lock()
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        self.reply(f"220 {self.server.hostname} StarFit SMTP sink")
+        sender = None
+        recipients = list()
+        n_messages = 0
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            command = line.decode(errors="replace").strip()
+            verb = command[:4].upper()
+            if verb == "HELO":
+                self.reply(f"250 {self.server.hostname}")
+            elif verb == "EHLO":
+                self.reply(f"250-{self.server.hostname}")
+                self.reply("250 8BITMIME")
+            elif verb == "MAIL":
+                sender = command.split(":", 1)[1].strip()
+                recipients = list()
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                recipients.append(command.split(":", 1)[1].strip())
+                self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = list()
+                while True:
+                    line = self.rfile.readline()
+                    if line in (b".\r\n", b".\n", b""):
+                        break
+                    if line.startswith(b".."):
+                        line = line[1:]
+                    data.append(line)
+                self.save(sender, recipients, b"".join(data))
+                n_messages += 1
+                self.reply("250 OK")
+            elif verb in ("RSET", "NOOP"):
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                break
+            else:
+                self.reply("502 Command not implemented")
+        print(
+            f"{self.client_address[0]}: {n_messages:d} message(s) on one connection",
+            file=sys.stderr,
+        )
+
+    def save(self, sender, recipients, data):
+        global counter
+        with counter_lock:
+            counter += 1
+            n = counter
+        path = self.server.directory / f"{n:06d}.eml"
+        with open(path, "wb") as f:
+            f.write(f"X-Sink-Sender: {sender}\r\n".encode())
+            f.write(f"X-Sink-Recipients: {', '.join(recipients)}\r\n".encode())
+            f.write(data)
+        print(
+            f"{path}: {len(data):d} bytes to {', '.join(recipients)}", file=sys.stderr
+        )
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, directory, hostname="localhost"):
+        super().__init__(address, SMTPHandler)
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.hostname = hostname
+
+        # Do not overwrite the messages of an earlier run
+        global counter
+        counter = len(list(self.directory.glob("*.eml")))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2525)
+    parser.add_argument("--dir", default="/tmp/starfit-mail")
+    args = parser.parse_args()
+
+    with SMTPSink((args.host, args.port), args.dir) as server:
+        print(f"Writing mail to {args.dir}/", file=sys.stderr)
+        server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()